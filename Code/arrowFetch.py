@@ -0,0 +1,65 @@
+"""
+Reads query results straight into Arrow tables with connectorx (optional, `pip install connectorx`).
+
+connectorx decodes the result set in native code instead of building a python object
+per value, which is most of the time and memory of reading wide tables with pd.read_sql.
+It opens its own connections from the URL of the engine, the pool isn't used.
+"""
+import functools
+import pathlib
+
+import pandas as pd
+
+# url schemes of sqlalchemy dialects that connectorx can read
+_SCHEMES = {
+    'mysql': 'mysql',
+    'mariadb': 'mysql',
+    'postgresql': 'postgresql',
+    'sqlite': 'sqlite',
+    'mssql': 'mssql',
+    'oracle': 'oracle'
+}
+
+
+@functools.lru_cache(maxsize=None)
+def available() -> bool:
+    try:
+        import connectorx  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def connectionUri(conn_engine):
+    """ connectorx url of an engine or connection, None when its database isn't supported."""
+    engine = getattr(conn_engine, 'engine', conn_engine)
+    url = getattr(engine, 'url', None)
+    if url is None:
+        return None
+    scheme = _SCHEMES.get(url.get_backend_name())
+    if scheme is None:
+        return None
+    if scheme == 'sqlite':
+        if not url.database or url.database == ':memory:':
+            return None
+        return 'sqlite://' + pathlib.Path(url.database).absolute().as_posix()
+    return url.set(drivername=scheme).render_as_string(hide_password=False)
+
+
+def fetchArrow(query: str, conn_engine):
+    """ Result of query as pyarrow Table."""
+    import connectorx
+    uri = connectionUri(conn_engine)
+    if uri is None:
+        raise ValueError(f"connectorx can't read from {conn_engine}")
+    return connectorx.read_sql(uri, query, return_type='arrow')
+
+
+def toPandas(table, dtype_backend='numpy') -> pd.DataFrame:
+    """
+    Dataframe of an Arrow table.
+    With dtype_backend='pyarrow' the columns keep their Arrow memory (pd.ArrowDtype), without a copy for most types.
+    """
+    if dtype_backend == 'pyarrow':
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
+    return table.to_pandas()
@@ -0,0 +1,155 @@
+"""
+Times and memory-profiles the dataset classes on a local stand-in database.
+
+    python benchmark.py --generate --clients 100000 --save-baseline
+    python benchmark.py            # compares with the stored baseline
+    python benchmark.py --strategies --clients 200000 --generate
+
+Regressions are datasets that take more time or memory than the baseline
+plus a tolerance; the exit code is 1 when there are any.
+"""
+import argparse
+import gc
+import json
+import pathlib
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+import configuration as config
+import syntheticData
+from datasetLoader import DATASETS, datasetClass
+
+DEFAULT_BASELINE = pathlib.Path(__file__).absolute().parents[1] / 'Sample_Data' / 'benchmarks' / 'baseline.json'
+
+# datasets of the latest row per client, see compareStrategies
+LATEST_DATASETS = [
+    'datasets_client.ResponsibleEmployees', 'datasets_client.Careagreements',
+    'datasets_client.Notifications'
+]
+
+
+def measure(build, repeat=3) -> dict:
+    """
+    Builds a dataset repeat times.
+    Returns the fastest time in seconds, the peak of memory allocated while building
+    and the size and memory of the resulting dataframe.
+    """
+    seconds = []
+    peak = 0
+    for _ in range(repeat):
+        gc.collect()
+        tracemalloc.start()
+        start = time.perf_counter()
+        dataset = build()
+        dataframe = dataset.dataframe
+        seconds.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        'seconds': min(seconds),
+        'peak_bytes': peak,
+        'rows': len(dataframe),
+        'columns': len(dataframe.columns),
+        'dataframe_bytes': int(dataframe.memory_usage(deep=True).sum())
+    }
+
+
+def run(datasets=DATASETS, repeat=3) -> pd.DataFrame:
+    """ Measures every dataset ('module.Class') on the current connection, without session or cache."""
+    import queryTable
+    cache, snapshots = queryTable.cache, queryTable.snapshots
+    queryTable.cache = queryTable.snapshots = None
+    queryTable.endSession()
+    try:
+        results = [
+            dict(dataset=name, **measure(datasetClass(name), repeat=repeat))
+            for name in datasets
+        ]
+    finally:
+        queryTable.cache, queryTable.snapshots = cache, snapshots
+    return pd.DataFrame(results).set_index('dataset')
+
+
+def compareStrategies(datasets=LATEST_DATASETS, repeat=3) -> pd.DataFrame:
+    """
+    Measures datasets built from the latest row per client with the latest rows picked
+    in the database (window) and in pandas (client), see latestPerKey.
+    """
+    import queryTable
+    derive_locally = queryTable.QueryTable.derive_locally
+    results = []
+    try:
+        for strategy, local in (('window', False), ('client', True)):
+            queryTable.QueryTable.derive_locally = local
+            results.append(run(datasets, repeat=repeat).assign(strategy=strategy))
+    finally:
+        queryTable.QueryTable.derive_locally = derive_locally
+    return pd.concat(results).set_index('strategy', append=True).sort_index()
+
+
+def compare(results, baseline, tolerance=0.25) -> pd.DataFrame:
+    """
+    Adds the baseline and the change relative to it to results.
+    A dataset regressed when time or peak memory grew more than tolerance.
+    """
+    baseline = pd.DataFrame.from_dict(baseline, orient='index')
+    report = results.join(baseline[['seconds', 'peak_bytes']], rsuffix='_baseline')
+    report['seconds_change'] = report['seconds'] / report['seconds_baseline'] - 1
+    report['peak_change'] = report['peak_bytes'] / report['peak_bytes_baseline'] - 1
+    report['regression'] = (report['seconds_change'] > tolerance) | (report['peak_change'] > tolerance)
+    return report
+
+
+def loadBaseline(path=DEFAULT_BASELINE):
+    path = pathlib.Path(path)
+    if not path.exists():
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def saveBaseline(results, path=DEFAULT_BASELINE):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(results.to_dict(orient='index'), file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database', default=str(syntheticData.DEFAULT_PATH))
+    parser.add_argument('--generate', action='store_true', help='generate the stand-in database first')
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--datasets', nargs='*', default=DATASETS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--strategies', action='store_true',
+                        help='compare picking the latest rows in the database and in pandas')
+    arguments = parser.parse_args()
+
+    if arguments.generate:
+        syntheticData.generate(arguments.database, clients=arguments.clients)
+    config.useEngine(syntheticData.standInEngine(arguments.database))
+
+    if arguments.strategies:
+        print(compareStrategies(repeat=arguments.repeat).to_string())
+        sys.exit(0)
+    results = run(arguments.datasets, repeat=arguments.repeat)
+    baseline = loadBaseline(arguments.baseline)
+    if arguments.save_baseline:
+        saveBaseline(results, arguments.baseline)
+        print(results.to_string())
+    elif baseline is None:
+        print(results.to_string())
+        print(f"No baseline at {arguments.baseline}, store one with --save-baseline")
+    else:
+        report = compare(results, baseline, tolerance=arguments.tolerance)
+        print(report.to_string())
+        if report['regression'].any():
+            print("Regressions: " + ', '.join(report.index[report['regression']]))
+            sys.exit(1)
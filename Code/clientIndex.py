@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+
+class ClientIndex(object):
+    """
+    Positions of the rows of every client in a dataframe.
+
+    - positions(clientObjectId) is a dictionary lookup instead of a scan of the dataframe.
+    - positionsOf(clientObjectIds) looks up many clients at once with a binary search.
+    Rows without clientObjectId are not indexed.
+    """
+
+    def __init__(self, clientObjectIds):
+        ids = pd.Series(clientObjectIds).reset_index(drop=True)
+        rows = np.flatnonzero(ids.notna().to_numpy())
+        ids = pd.to_numeric(ids.iloc[rows]).to_numpy()
+        order = np.argsort(ids, kind='stable')
+        # rows of the dataframe ordered by client, rows of a client in their original order
+        self.rows = rows[order]
+        self.keys, self.starts, self.counts = np.unique(
+            ids[order], return_index=True, return_counts=True)
+        self._slots = {key: slot for slot, key in enumerate(self.keys.tolist())}
+
+    def __len__(self):
+        """ Number of unique clients."""
+        return len(self.keys)
+
+    def __contains__(self, clientObjectId):
+        return clientObjectId in self._slots
+
+    def positions(self, clientObjectId) -> np.ndarray:
+        """ Row positions of one client."""
+        slot = self._slots.get(clientObjectId)
+        if slot is None:
+            return np.empty(0, dtype=np.intp)
+        start = self.starts[slot]
+        return self.rows[start:start + self.counts[slot]]
+
+    def positionsOf(self, clientObjectIds) -> np.ndarray:
+        """ Row positions of all given clients, grouped in the order of clientObjectIds."""
+        ids = pd.to_numeric(pd.Series(clientObjectIds).dropna()).to_numpy()
+        slots = np.searchsorted(self.keys, ids)
+        found = slots < len(self.keys)
+        found[found] = self.keys[slots[found]] == ids[found]
+        slots = slots[found]
+        counts = self.counts[slots]
+        # first row of every client repeated for each of its rows, plus the offset within the client
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.rows[np.repeat(self.starts[slots], counts) + offsets]
@@ -0,0 +1,133 @@
+"""
+Labels of the coded columns of the ONS database.
+
+    DISCUSSION_TYPE.decode(dataframe['discussionType'])           # codes to a categorical of labels
+    NOTIFICATION_TYPE.condition('n.notificationTypeObjectId',
+                                'client in zorg opgenomen')      # SQL filter by label
+
+Code tables defined here only know the codes the datasets use; complete tables
+can be read from the ONS lookup tables with loadCodeTable.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from queryTable import QueryTable, sqlLiteral
+
+# registered code tables by name, see register and codeTable
+tables = {}
+
+
+class CodeTable(object):
+    """
+    Labels of the codes of a column.
+
+    - decode turns a column of codes into a categorical of labels with a single lookup.
+    - code and condition translate labels to codes, so filters can be written by name.
+    """
+
+    def __init__(self, name, labels: dict):
+        self.name = name
+        self.labels = dict(labels)
+        self._codes = pd.Index(list(self.labels))
+        self._categories = pd.Index(list(self.labels.values())).unique()
+        # position of the label of every code in the categories
+        self._positions = self._categories.get_indexer(list(self.labels.values()))
+
+    def __repr__(self):
+        return f"CodeTable({self.name!r}, {len(self.labels)} codes)"
+
+    def __contains__(self, code):
+        return code in self.labels
+
+    def code(self, label):
+        """ Code of label, the first one when more codes have the same label."""
+        for code, code_label in self.labels.items():
+            if code_label == label:
+                return code
+        raise KeyError(f"{label!r} is not a label of code table {self.name!r}")
+
+    def codes(self, labels) -> list:
+        """ All codes with one of labels."""
+        if isinstance(labels, str):
+            labels = [labels]
+        unknown = set(labels) - set(self.labels.values())
+        if unknown:
+            raise KeyError(f"{sorted(unknown)} are not labels of code table {self.name!r}")
+        labels = set(labels)
+        return [code for code, label in self.labels.items() if label in labels]
+
+    def condition(self, column: str, labels, negate=False, dialect='mysql') -> str:
+        """ SQL condition on column being one of the codes of labels, or none of them with negate=True."""
+        literals = ', '.join(sqlLiteral(code, dialect) for code in self.codes(labels))
+        return f"{column} {'not in' if negate else 'in'} ({literals})"
+
+    def decode(self, series) -> pd.Series:
+        """
+        Labels of the codes in series as categorical.
+        Unknown codes are kept as they are, as extra categories, with a warning.
+        """
+        series = pd.Series(series)
+        positions = self._codes.get_indexer(series.to_numpy())
+        codes = np.where(positions >= 0, self._positions[positions], -1)
+        categories = self._categories
+        unknown = (positions < 0) & series.notna().to_numpy()
+        if unknown.any():
+            extra, inverse = np.unique(series[unknown].to_numpy(), return_inverse=True)
+            warnings.warn(f"Codes {extra.tolist()} of {series.name} are not in code table {self.name!r}, kept as they are")
+            codes[unknown] = len(categories) + inverse
+            categories = categories.append(pd.Index(extra, dtype=object))
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories),
+                         index=series.index, name=series.name)
+
+
+def register(table: CodeTable) -> CodeTable:
+    """ Makes table available by its name, replacing a table with the same name."""
+    tables[table.name] = table
+    return table
+
+
+def codeTable(name) -> CodeTable:
+    try:
+        return tables[name]
+    except KeyError:
+        raise KeyError(f"No code table called {name!r}, known tables: {sorted(tables)}") from None
+
+
+def decodeFrame(dataframe, columns: dict) -> pd.DataFrame:
+    """ Decodes each column of dataframe with the code table named in {column: table name}."""
+    for column, name in columns.items():
+        dataframe[column] = codeTable(name).decode(dataframe[column])
+    return dataframe
+
+
+class _LookupTable(QueryTable):
+    # lookup tables rarely change
+    cache_ttl = 7 * 24 * 60 * 60
+
+
+def loadCodeTable(name, table, code='objectId', label='description', conn_engine=None) -> CodeTable:
+    """
+    Registers the code table name from an ONS lookup table, e.g.
+
+        loadCodeTable('notificationType', 'notification_types', label='name')
+
+    Reading goes through the session and the result cache like any dataset.
+    """
+    query = f"select {code}, {label} from {table}"
+    rows = _LookupTable(query, conn_engine=conn_engine).dataframe
+    return register(CodeTable(name, dict(zip(rows[code], rows[label]))))
+
+
+DISCUSSION_TYPE = register(CodeTable('discussionType', {
+    0: 'Is besproken en akkoord',
+    1: 'wordt later besproken',
+    2: 'wordt niet besproken',
+    3: 'niet akkoord'
+}))
+CAREPLAN_STATUS = register(CodeTable('careplanStatus', {0: 'Concept', 1: 'Actief', 2: 'Oud'}))
+DOCUMENT_STATUS = register(CodeTable('documentStatus', {3: 'verwijderd'}))
+DOCUMENT_TAG = register(CodeTable('documentTag', {14: 'zorgovereenkomst', 32: 'zorgplan'}))
+NOTIFICATION_TYPE = register(CodeTable('notificationType', {152: 'client in zorg opgenomen'}))
+LOCATION_TYPE = register(CodeTable('locationType', {1: 'kamer'}))
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+
+# Kinds of columns a dataset can declare in its schema
+CATEGORY = 'category'
+INT = 'int'
+DATE = 'date'
+BOOL = 'bool'
+STRING = 'string'
+
+_INTEGERS = [np.int8, np.int16, np.int32, np.int64]
+
+
+def downcastInteger(series, smallest=True):
+    """
+    Smallest integer type holding all values, a nullable type when series has nulls.
+    With smallest=False always 64 bits, so every chunk of a result gets the same type.
+    """
+    values = pd.to_numeric(series, errors='coerce')
+    nulls = values.isna()
+    if nulls.all():
+        return values.astype('Int8' if smallest else 'Int64')
+    present = values[~nulls]
+    if (present != np.floor(present)).any():
+        # not an integer column after all
+        return values
+    low, high = present.min(), present.max()
+    for integer in _INTEGERS if smallest else _INTEGERS[-1:]:
+        info = np.iinfo(integer)
+        if info.min <= low and high <= info.max:
+            break
+    if nulls.any():
+        return values.astype(pd.api.types.pandas_dtype(integer.__name__.capitalize()))
+    return values.astype(integer)
+
+
+def parseDates(series):
+    """ Dates as datetime64, including dates beyond 2262 like 9999-12-31."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    try:
+        return pd.to_datetime(series)
+    except pd.errors.OutOfBoundsDatetime:
+        return series.astype('datetime64[s]')
+
+
+def compactFrame(dataframe, schema: dict, chunked=False):
+    """
+    Converts the columns of dataframe named in schema to compact types.
+
+    Parameters
+    ------
+    dataframe (type: pandas DataFrame)
+    schema (type: dict) : {column: kind}, kind is one of
+        category : repetitive strings as categorical
+        int : identifiers and codes downcast to the smallest (nullable) integer type
+        date : parsed to datetime64
+        bool : nullable boolean
+        string : pandas string type
+    chunked (type: bool) : dataframe is a chunk of a larger result, integers get a fixed width
+        instead of the smallest one of the chunk's values, so all chunks have the same types
+    Returns
+    ------
+    dataframe with converted columns, columns not in dataframe are ignored
+    """
+    converted = {}
+    for column, kind in schema.items():
+        if column not in dataframe.columns:
+            continue
+        series = dataframe[column]
+        if kind == CATEGORY:
+            converted[column] = series.astype('category')
+        elif kind == INT:
+            converted[column] = downcastInteger(series, smallest=not chunked)
+        elif kind == DATE:
+            converted[column] = parseDates(series)
+        elif kind == BOOL:
+            converted[column] = series.astype('boolean')
+        elif kind == STRING:
+            converted[column] = series.astype('string')
+        else:
+            raise ValueError(f"Unknown column kind {kind} for column {column}")
+    if not converted:
+        return dataframe
+    return dataframe.assign(**converted)
+
+
+def memoryUsage(dataframe) -> int:
+    """ Resident memory of dataframe in bytes, including the contents of strings."""
+    return int(dataframe.memory_usage(deep=True).sum())
@@ -1,21 +1,48 @@
-import pandas as pd
-import sqlalchemy
-from sqlalchemy import *
-from sqlalchemy.engine import create_engine
-from sqlalchemy.schema import *
-from sqlalchemy.types import NVARCHAR, Float, Integer
+"""
+Connection to the ONS database.
+
+Importing this module is cheap: sqlalchemy and yaml are imported, the configuration is read
+and a connection is opened when the first query runs. The configuration is read once from
+configuration.yaml, searched by configurationPath, and ONS_* environment variables
+(e.g. ONS_DB_PASSWORD for db_password), which take precedence over the file.
+"""
+import contextlib
+import instrumentation
+import os
 import pathlib
-import yaml
+import threading
+
+# attributes of the configuration, see Readme
+SETTINGS = ['db_server', 'db_port', 'db_username', 'db_password', 'dialect', 'driver', 'db']
+POOL_SETTINGS = {'pool_size': int, 'max_overflow': int, 'pool_timeout': int, 'recycle': int,
+                 'pre_ping': lambda value: str(value).lower() in ('1', 'true', 'yes')}
+# environment variable with the path of the configuration file
+CONFIGURATION_VARIABLE = 'ONS_CONFIGURATION'
+_FILE_NAME = 'configuration.yaml'
+
+_pool = None
+_settings = None
+_lock = threading.Lock()
 
 
 class Connections(object):
+    """
+    Pool of connections to the ONS database.
+
+    - Datasets check out a connection per query from engine, see queryTable.checkedOut.
+    - run_connection is a connection per thread, taken from the pool on first use (config.conn_engine).
+    - with connection() as conn: checks out a connection for the duration of the block.
+    - Connections are tested before use (pre_ping) and replaced after recycle seconds,
+      so long running notebooks don't fail on connections closed by the server.
+    """
     conn = None
     user = None
     passw = None
     server = None
     port = None
 
-    def __init__(self, username, password, server, port, dialect, driver, db):
+    def __init__(self, username, password, server, port, dialect, driver, db,
+                 pool_size=5, max_overflow=10, pool_timeout=30, recycle=3600, pre_ping=True):
         self.user = username
         self.passw = password
         self.server = server
@@ -23,32 +50,102 @@ class Connections(object):
         self.dialect = dialect
         self.driver = driver
         self.db = db
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._engine = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._thread_connections = set()
+
+    @classmethod
+    def fromEngine(cls, engine):
+        """ Connections using an existing engine, e.g. a local stand-in for the ONS database."""
+        url = engine.url
+        connections = cls(url.username, url.password, url.host, url.port,
+                          url.get_backend_name(), url.get_driver_name(), url.database)
+        connections._engine = engine
+        return connections
 
     def __enter__(self):
         return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def engine(self):
+        """ Engine holding the pool, shared by all threads."""
+        with self._lock:
+            if self._engine is None:
+                from sqlalchemy import create_engine
+                print(f"Connecting to {self.db} on {self.server}:{self.port}..")
+                self._engine = create_engine(
+                    f"{self.dialect}+{self.driver}://{self.user}:{self.passw}@{self.server}:{self.port}/{self.db}",
+                    pool_size=self.pool_size,
+                    max_overflow=self.max_overflow,
+                    pool_timeout=self.pool_timeout,
+                    pool_recycle=self.recycle,
+                    pool_pre_ping=self.pre_ping
+                )
+        return self._engine
+
     def connect(self):
-        eng = create_engine(
-            f"{self.dialect}+{self.driver}://{self.user}:{self.passw}@{self.server}:{self.port}/{self.db}",
-            max_overflow=-1
-        )
-        print(f"Connecting to {db} on {self.server}:{self.port}..")
-        conn = eng.connect()
-        print(f"Connected")
+        """ Checks out a connection from the pool, close it to return it."""
+        with instrumentation.span(str(self.db), 'connection') as span:
+            conn = self.engine.connect()
+            span.set(pool_checked_out=self._checkedOut())
         return conn
 
+    def _checkedOut(self):
+        # connections in use, when the pool can tell
+        checkedout = getattr(self._engine.pool, 'checkedout', None)
+        return checkedout() if checkedout is not None else None
+
+    @contextlib.contextmanager
+    def connection(self):
+        """ Connection from the pool that is returned when the with-block ends."""
+        conn = self.connect()
+        try:
+            yield conn
+        finally:
+            self.closeconn(conn)
+
     def closeconn(self, conn):
         if conn != None:
             conn.close()
 
-    def close(self):
+    def release(self):
+        """ Returns the connection of the calling thread to the pool."""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        with self._lock:
+            self._thread_connections.discard(conn)
         self.closeconn(conn)
 
+    def close(self):
+        """ Closes the connections of all threads and the pool."""
+        with self._lock:
+            connections = list(self._thread_connections)
+            self._thread_connections.clear()
+            engine, self._engine = self._engine, None
+        for conn in connections:
+            self.closeconn(conn)
+        self._local = threading.local()
+        if engine is not None:
+            engine.dispose()
+
     @property
     def run_connection(self):
-        if self.conn == None:
-            self.conn = self.connect()
-        return self.conn
+        """ Connection of the calling thread, connections can't be shared between threads."""
+        conn = getattr(self._local, 'conn', None)
+        if conn == None or conn.closed:
+            conn = self._local.conn = self.connect()
+            with self._lock:
+                self._thread_connections.add(conn)
+        return conn
 
 
 def table_exists(table_name: str, connection: object):
@@ -64,32 +161,84 @@ def table_exists(table_name: str, connection: object):
     return connection.dialect.has_table(connection, table_name)
 
 
+def configurationPath():
+    """
+    The configuration file: the path in ONS_CONFIGURATION, or the first configuration.yaml
+    in the folder of this module, the working directory or one of its parents (or their Code folder).
+    None when there is none.
+    """
+    if os.environ.get(CONFIGURATION_VARIABLE):
+        return pathlib.Path(os.environ[CONFIGURATION_VARIABLE])
+    working = pathlib.Path.cwd()
+    folders = [pathlib.Path(__file__).absolute().parent]
+    for folder in [working, *working.parents]:
+        folders += [folder, folder / 'Code']
+    for folder in folders:
+        if (folder / _FILE_NAME).is_file():
+            return folder / _FILE_NAME
+    return None
+
+
+def settings() -> dict:
+    """ The configuration, read on first use. Raises FileNotFoundError when it is incomplete."""
+    global _settings
+    with _lock:
+        if _settings is None:
+            values = {}
+            path = configurationPath()
+            if path is not None:
+                import yaml
+                with open(path) as file:
+                    values.update(yaml.full_load(file) or {})
+            for setting in SETTINGS + list(POOL_SETTINGS):
+                if f"ONS_{setting.upper()}" in os.environ:
+                    value = os.environ[f"ONS_{setting.upper()}"]
+                    values[setting] = POOL_SETTINGS[setting](value) if setting in POOL_SETTINGS else value
+            missing = [setting for setting in SETTINGS if setting not in values]
+            if missing:
+                raise FileNotFoundError(
+                    f"The ONS configuration misses {missing}. Put them in a {_FILE_NAME} in the Code folder "
+                    f"(or point {CONFIGURATION_VARIABLE} to one), set ONS_* environment variables, "
+                    "or run on a local stand-in with useEngine.")
+            _settings = values
+        return _settings
+
+
+def getPool():
+    """ Connections to the configured database, created on first use; no connection is opened yet."""
+    global _pool
+    if _pool is None:
+        values = settings()
+        with _lock:
+            if _pool is None:
+                _pool = Connections(
+                    values['db_username'], values['db_password'], values['db_server'], values['db_port'],
+                    values['dialect'], values['driver'], values['db'],
+                    **{setting: values[setting] for setting in POOL_SETTINGS if setting in values})
+    return _pool
+
+
+def useEngine(engine):
+    """
+    Runs all following queries on engine instead of the configured database.
+    The connections of the previous pool are closed.
+    """
+    global _pool
+    with _lock:
+        previous, _pool = _pool, Connections.fromEngine(engine)
+    if previous is not None and previous._engine is not engine:
+        previous.close()
+    return _pool
+
+
+def __getattr__(name):
+    # pool and conn_engine are created when they are first used instead of on import
+    if name == 'pool':
+        return getPool()
+    if name == 'conn_engine':
+        return getPool().run_connection
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
     print("Error: This module shouldn't be calles directly.")
-else:
-    # Configure server connection variables
-    path_parents = pathlib.Path().absolute().parents
-    path = pathlib.Path().absolute()
-    for parent in path_parents:
-        folder_name = str(parent).split('\\')[-1]
-        if folder_name == 'Code':
-            path = parent
-
-    try:
-        with open(str(path) + '\\configuration.yaml') as file:
-            yaml_config = yaml.full_load(file)
-            db_server = yaml_config['db_server']
-            db_port = yaml_config['db_port']
-            db_username = yaml_config['db_username']
-            db_password = yaml_config['db_password']
-            dialect = yaml_config['dialect']
-            driver = yaml_config['driver']
-            db = yaml_config['db']
-    except Exception as e:
-        print('A yaml file called "configuration.yaml" should be in a folder called "Code" which should be within called file\'s path.')
-        print(e)
-    finally:
-        # Get connection engine
-        pool = Connections(db_username, db_password,
-                           db_server, db_port, dialect, driver, db)
-        conn_engine = pool.run_connection
@@ -0,0 +1,181 @@
+"""
+Exports datasets to a versioned snapshot of Arrow files and opens them memory-mapped.
+
+    python datasetExport.py Output/exports                      # builds and exports all datasets
+
+    snapshot = datasetExport.openSnapshot('Output/exports')    # latest version
+    snapshot['IntramuralClients']
+    snapshot['IntramuralLocations.afdelingen']
+
+Files are uncompressed Arrow IPC files, so opening a frame maps the file into memory
+instead of reading it: notebook kernels opening the same snapshot share the pages.
+"""
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import shutil
+
+import pandas as pd
+
+from datasetLoader import DATASETS, datasetClass, loadDatasets
+
+_MANIFEST = 'manifest.json'
+_LATEST = 'LATEST'
+
+
+def _frames(dataset):
+    # (name, dataframe) of a dataset object and the frames derived from it
+    name = type(dataset).__name__
+    yield name, dataset.dataframe
+    for attribute in dataset.derived_frames:
+        yield f"{name}.{attribute}", getattr(dataset, attribute)
+
+
+def _writeArrow(dataframe, path):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(dataframe)
+    with pa.OSFile(str(path), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return table
+
+
+def exportSnapshot(directory, datasets=DATASETS, version=None, max_workers=4, pseudonymize=False) -> pathlib.Path:
+    """
+    Builds datasets (classes or 'module.Class' names) and writes them with their derived frames
+    to directory/version. The version becomes the latest once all frames are written.
+
+    Parameters
+    ------
+    directory (type: string) : folder with all versions
+    version (type: string) : name of the version, the current time by default
+    max_workers (type: int) : datasets built concurrently, see datasetLoader
+    pseudonymize (type: bool) : replace personal data by pseudonyms, see pseudonymization.enablePseudonyms
+    Returns
+    ------
+    folder of the version
+    """
+    directory = pathlib.Path(directory)
+    version = version or datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    classes = [datasetClass(dataset) if isinstance(dataset, str) else dataset for dataset in datasets]
+    built = loadDatasets(classes, max_workers=max_workers)
+    if pseudonymize:
+        for dataset in built.values():
+            if hasattr(dataset, 'pseudonymize'):
+                dataset.pseudonymize()
+
+    target = directory / version
+    if target.exists():
+        raise FileExistsError(f"Snapshot version {version} already exists in {directory}")
+    partial = directory / (version + '.partial')
+    shutil.rmtree(partial, ignore_errors=True)
+    partial.mkdir(parents=True)
+    manifest = {'version': version, 'created': datetime.datetime.now().isoformat(),
+                'pseudonymized': pseudonymize, 'frames': {}}
+    for dataset in built.values():
+        for name, dataframe in _frames(dataset):
+            table = _writeArrow(dataframe, partial / f"{name}.arrow")
+            manifest['frames'][name] = {
+                'file': f"{name}.arrow",
+                'rows': table.num_rows,
+                'columns': [str(column) for column in dataframe.columns]
+            }
+    with open(partial / _MANIFEST, 'w') as file:
+        json.dump(manifest, file, indent=2, default=str)
+    os.replace(partial, target)
+    with open(directory / (_LATEST + '.tmp'), 'w') as file:
+        file.write(version)
+    os.replace(directory / (_LATEST + '.tmp'), directory / _LATEST)
+    return target
+
+
+def versions(directory) -> list:
+    """ Exported versions in directory, oldest first."""
+    directory = pathlib.Path(directory)
+    if not directory.exists():
+        return []
+    return sorted(path.name for path in directory.iterdir() if (path / _MANIFEST).exists())
+
+
+class Snapshot(object):
+    """
+    Exported frames of one version, read on first access.
+
+    With dtype_backend='pyarrow' columns point into the memory-mapped files (pd.ArrowDtype)
+    and nothing is copied; 'numpy' converts to the regular dtypes, which copies the data.
+    """
+
+    def __init__(self, path, dtype_backend='pyarrow'):
+        self.path = pathlib.Path(path)
+        self.dtype_backend = dtype_backend
+        with open(self.path / _MANIFEST) as file:
+            self.manifest = json.load(file)
+        self._frames = {}
+
+    @property
+    def version(self) -> str:
+        return self.manifest['version']
+
+    @property
+    def names(self) -> list:
+        return list(self.manifest['frames'])
+
+    def __contains__(self, name):
+        return name in self.manifest['frames']
+
+    def __getitem__(self, name) -> pd.DataFrame:
+        if name not in self._frames:
+            if name not in self:
+                raise KeyError(f"{name} is not in snapshot {self.version}, it has {self.names}")
+            self._frames[name] = self._read(name)
+        return self._frames[name]
+
+    def table(self, name):
+        """ Frame name as memory-mapped pyarrow Table."""
+        import pyarrow as pa
+        source = pa.memory_map(str(self.path / self.manifest['frames'][name]['file']))
+        return pa.ipc.open_file(source).read_all()
+
+    def _read(self, name):
+        import pyarrow as pa
+        table = self.table(name)
+        if self.dtype_backend != 'pyarrow':
+            return table.to_pandas()
+        # dictionary columns become categoricals, like the datasets themselves
+        return table.to_pandas(types_mapper=lambda type: None if pa.types.is_dictionary(type) else pd.ArrowDtype(type))
+
+
+def openSnapshot(directory, version=None, dtype_backend='pyarrow') -> Snapshot:
+    """ Opens a version exported to directory, the latest one by default."""
+    directory = pathlib.Path(directory)
+    if version is None:
+        try:
+            version = (directory / _LATEST).read_text().strip()
+        except OSError:
+            raise FileNotFoundError(f"No snapshot exported to {directory}") from None
+    return Snapshot(directory / version, dtype_backend=dtype_backend)
+
+
+if __name__ == "__main__":
+    import configuration as config
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--version')
+    parser.add_argument('--datasets', nargs='*', default=DATASETS)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--database', help='local stand-in database to export from instead of ONS')
+    parser.add_argument('--pseudonymize', action='store_true',
+                        help='replace personal data by pseudonyms, with the key in ONS_PSEUDONYM_KEY')
+    arguments = parser.parse_args()
+
+    if arguments.database:
+        import syntheticData
+        config.useEngine(syntheticData.standInEngine(arguments.database))
+    if arguments.pseudonymize:
+        import pseudonymization
+        pseudonymization.enablePseudonyms()
+    target = exportSnapshot(arguments.directory, arguments.datasets, version=arguments.version,
+                            max_workers=arguments.workers, pseudonymize=arguments.pseudonymize)
+    print(f"Exported {len(Snapshot(target).names)} frames to {target}")
@@ -0,0 +1,161 @@
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+import queryTable
+
+# all dataset classes as 'module.Class', see datasetClass
+DATASETS = [
+    'datasets.Locations', 'datasets.IntramuralLocations', 'datasets.ExtramuralLocations', 'datasets.RentingLocations',
+    'datasets.LocationsForPsychogeriatric', 'datasets.Employees',
+    'datasets_client.ClientsInCare', 'datasets_client.LocationAssignments',
+    'datasets_client.IntramuralClients', 'datasets_client.ExtramuralClients',
+    'datasets_client.PgClients', 'datasets_client.Indications',
+    'datasets_client.ResponsibleEmployees', 'datasets_client.LegalRepresentative',
+    'datasets_client.Careagreements', 'datasets_client.Notifications',
+    'datasets_client.Rekenmodule'
+]
+
+
+def datasetClass(name):
+    """ Dataset class from 'module.Class'."""
+    module, cls = name.rsplit('.', 1)
+    return getattr(__import__(module), cls)
+
+
+def resolveDependencies(dataset) -> tuple:
+    """ Dependencies of a dataset class, names are looked up in the module of the class."""
+    module = sys.modules[dataset.__module__]
+    return tuple(
+        getattr(module, dependency) if isinstance(dependency, str) else dependency
+        for dependency in dataset.dependencies
+    )
+
+
+def dependencyGraph(datasets) -> dict:
+    """
+    Returns {dataset class: set of dataset classes it depends on} for datasets
+    and everything they depend on.
+    """
+    graph = {}
+    todo = list(datasets)
+    while todo:
+        dataset = todo.pop()
+        if dataset in graph:
+            continue
+        graph[dataset] = set(resolveDependencies(dataset))
+        todo.extend(graph[dataset])
+    return graph
+
+
+class DatasetLoader(object):
+    """
+    Builds dataset classes concurrently, respecting their dependencies.
+
+    - Independent datasets are built on a thread pool, every query checks out a database connection of its own.
+    - All datasets are built in one session, datasets reuse the results of the datasets they depend on.
+    - timings contains the start, end and duration in seconds of every dataset.
+
+        loader = DatasetLoader([IntramuralClients, ExtramuralClients, PgClients])
+        datasets = loader.run()
+        loader.timingReport()
+    """
+
+    def __init__(self, datasets, max_workers=4):
+        self.datasets = list(datasets)
+        self.graph = dependencyGraph(self.datasets)
+        self.max_workers = max_workers
+        self.results = {}
+        self.timings = {}
+
+    def run(self) -> dict:
+        """ Builds all datasets and returns {dataset class: dataset object}."""
+        self._checkAcyclic()
+        self.results = {}
+        self.timings = {}
+        started = time.perf_counter()
+        with queryTable.session(), ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+            while len(self.results) < len(self.graph):
+                for dataset in self._ready(running.values()):
+                    running[pool.submit(self._build, dataset, started)] = dataset
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dataset = running.pop(future)
+                    # raises the exception of a failed dataset, datasets that have not started are skipped
+                    self.results[dataset] = future.result()
+        return {dataset: self.results[dataset] for dataset in self.datasets}
+
+    def timingReport(self):
+        """ Dataframe with the timings of the last run, ordered by start."""
+        report = pd.DataFrame([
+            dict(dataset=dataset.__name__, **timing)
+            for dataset, timing in self.timings.items()
+        ])
+        if report.empty:
+            return report
+        return report.sort_values('start').reset_index(drop=True)
+
+    @property
+    def criticalPath(self) -> list:
+        """ Chain of dependencies with the longest total duration in the last run."""
+        longest = {}
+
+        def pathTo(dataset):
+            if dataset not in longest:
+                paths = [pathTo(dependency) for dependency in self.graph[dataset]]
+                path = max(paths, key=self._duration, default=[])
+                longest[dataset] = path + [dataset]
+            return longest[dataset]
+
+        return max((pathTo(dataset) for dataset in self.graph), key=self._duration, default=[])
+
+    def _duration(self, path) -> float:
+        return sum(self.timings.get(dataset, {}).get('seconds', 0) for dataset in path)
+
+    def _ready(self, running):
+        return [
+            dataset for dataset, dependencies in self.graph.items()
+            if dataset not in self.results
+            and dataset not in running
+            and dependencies.issubset(self.results)
+        ]
+
+    def _build(self, dataset, started):
+        start = time.perf_counter()
+        result = dataset()
+        # lazy datasets are loaded here instead of by whoever uses them first
+        result.dataframe
+        end = time.perf_counter()
+        self.timings[dataset] = {
+            'start': start - started,
+            'end': end - started,
+            'seconds': end - start,
+            'rows': len(result.dataframe),
+            'thread': threading.current_thread().name
+        }
+        return result
+
+    def _checkAcyclic(self):
+        visiting, visited = set(), set()
+
+        def visit(dataset):
+            if dataset in visited:
+                return
+            if dataset in visiting:
+                raise ValueError(f"Circular dependency on {dataset.__name__}")
+            visiting.add(dataset)
+            for dependency in self.graph[dataset]:
+                visit(dependency)
+            visiting.discard(dataset)
+            visited.add(dataset)
+
+        for dataset in self.graph:
+            visit(dataset)
+
+
+def loadDatasets(datasets, max_workers=4) -> dict:
+    """ Builds datasets concurrently, see DatasetLoader."""
+    return DatasetLoader(datasets, max_workers=max_workers).run()
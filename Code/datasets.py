@@ -1,7 +1,71 @@
 import configuration as config
 import pandas as pd
+import queryTable
 from datetime import datetime
-from queryTable import QueryTable
+from codeTables import LOCATION_TYPE
+from locationTree import TAGS, LocationTree
+from queryTable import QueryTable, sqlLiteral
+
+
+class Locations(QueryTable):
+    """
+    Object based on the locations table, with the hierarchy of locations as tree.
+    """
+    cache_ttl = 24 * 60 * 60
+    query = """
+        select
+            objectId,
+            parentObjectId,
+            name,
+            type
+        from locations
+        """
+
+    schema = {'objectId': 'int', 'parentObjectId': 'int', 'type': 'int'}
+
+    def __init__(self, conn_engine=None, lazy=False):
+        super().__init__(query=self.query, conn_engine=conn_engine, lazy=lazy)
+
+    @property
+    def tree(self) -> LocationTree:
+        if getattr(self, '_tree', None) is None:
+            self._tree = LocationTree(self.dataframe)
+        return self._tree
+
+
+def locationTree(conn_engine=None) -> LocationTree:
+    """
+    Tree of the locations table. Within a session it is built once per connection and shared
+    by all location datasets, outside of one every call reads the locations.
+    """
+    locations = Locations(conn_engine, lazy=True)
+    if queryTable.registry is None:
+        return locations.tree
+    return queryTable.registry.shared('locationTree', locations.connection, lambda: locations.tree)
+
+
+class _TreeLocations(QueryTable):
+    # Locations selected from the location tree on load (see fromTree) instead of running query.
+    # query reads the same locations, for iter_chunks, arrowTable and loads with selected columns or conditions.
+    cache_ttl = 24 * 60 * 60
+    dependencies = ('Locations',)
+
+    def __init__(self, tree=None, lazy=False):
+        self._tree = tree
+        super().__init__(query=self.query, lazy=lazy)
+
+    @property
+    def tree(self) -> LocationTree:
+        if self._tree is None:
+            self._tree = locationTree(self.conn_engine)
+        return self._tree
+
+    def localRows(self):
+        return self.fromTree(self.tree)
+
+    def fromTree(self, tree):
+        """ The rows of query, selected from tree."""
+        raise NotImplementedError
 
 
 class IntramuralLocations(QueryTable):
@@ -10,45 +74,74 @@ class IntramuralLocations(QueryTable):
 
     | kamerId | kamerNaam | afdelingId | afdelingNaam | locationId | locatieNaam |
     """
-    query = """
-        select 
-            afdeling.objectId as kamerId,
-            afdeling.name as kamerNaam,
-            afdeling.intramuralLocation,
+    # locations rarely change, cached results stay valid for a day
+    cache_ttl = 24 * 60 * 60
+    dependencies = ('RentingLocations', 'Locations')
+    derived_frames = ('afdelingen', 'locaties')
+    query = f"""
+        select
+            l.objectId as kamerId,
+            l.name as kamerNaam,
+            l.intramuralLocation,
             r.description as roomType,
-            afdeling.afdelingId,
-            afdeling.afdelingNaam,
-            afdeling.locationId,
-            locations.name as locatieNaam 
-        from locations
-        join (
-            select
-                kamers.*,
-                locations.objectId as afdelingId,
-                locations.name as afdelingNaam,
-                locations.parentObjectId as locationId
-            from locations
-            right join (
-                select * from locations
-                where type = 1
-            ) as kamers on kamers.parentObjectId = locations.objectId
-        ) as afdeling on afdeling.locationId = locations.objectId
-        left join roomtypes r on r.objectId = afdeling.roomTypeObjectId
+            l.parentObjectId as afdelingId
+        from locations l
+        left join roomtypes r on r.objectId = l.roomTypeObjectId
+        where {LOCATION_TYPE.condition('l.type', 'kamer')}
         """
 
-    def __init__(self):
-        super().__init__(query=self.query)
-        self.kamers = self.__clean_hoge_prins_willemhof(self.dataframe)
-        self.kamers = self.__clean_renting(self.kamers, 'kamerId')
-        self.dataframe = self.kamers
-
-        self.afdelingen = self.kamers[[
+    schema = {
+        'kamerId': 'int', 'afdelingId': 'int', 'locationId': 'int',
+        'intramuralLocation': 'int', 'roomType': 'category',
+        'afdelingNaam': 'category', 'locatieNaam': 'category'
+    }
+
+    def __init__(self, tree=None, lazy=False):
+        self._tree = tree
+        super().__init__(query=self.query, lazy=lazy)
+
+    @property
+    def tree(self) -> LocationTree:
+        if self._tree is None:
+            self._tree = locationTree(self.conn_engine)
+        return self._tree
+
+    @property
+    def rentingIds(self) -> set:
+        if getattr(self, '_rentingIds', None) is None:
+            self._rentingIds = set(RentingLocations(self.tree).dataframe['locationId'])
+        return self._rentingIds
+
+    def transform(self, dataframe):
+        """ Adds the afdeling and location of the kamers, also to every chunk of iter_chunks."""
+        kamers = self.__add_hierarchy(dataframe, self.tree)
+        kamers = self.__clean_hoge_prins_willemhof(kamers)
+        return self.__clean_renting(kamers, 'kamerId')
+
+    @property
+    def kamers(self):
+        return self.dataframe
+
+    @property
+    def afdelingen(self):
+        afdelingen = self.kamers[[
             'afdelingId', 'afdelingNaam', 'locationId', 'locatieNaam']].drop_duplicates()
-        self.afdelingen = self.__clean_renting(self.afdelingen, 'afdelingId')
+        return self.__clean_renting(afdelingen, 'afdelingId')
 
-        self.locaties = self.afdelingen[[
+    @property
+    def locaties(self):
+        locaties = self.afdelingen[[
             'locationId', 'locatieNaam']].drop_duplicates()
-        self.locaties = self.__clean_renting(self.locaties, 'locationId')
+        return self.__clean_renting(locaties, 'locationId')
+
+    def __add_hierarchy(self, kamers, tree):
+        # afdeling is the parent of a kamer, location the parent of the afdeling
+        kamers['afdelingNaam'] = tree.nameOf(kamers['afdelingId'])
+        kamers['locationId'] = tree.parentOf(kamers['afdelingId'])
+        kamers['locatieNaam'] = tree.nameOf(kamers['locationId'])
+        # kamers without afdeling or location aren't part of an intramural location
+        kamers = kamers[kamers['locationId'].notna()]
+        return kamers.astype({'afdelingId': 'int64', 'locationId': 'int64'})
 
     def __clean_hoge_prins_willemhof(self, location_df):
         # location Hoge Prins Willemhof has only two location layers
@@ -60,39 +153,35 @@ class IntramuralLocations(QueryTable):
 
     def __clean_renting(self, location_df, col):
         # print(location_df[col].unique())
-        rentingIds = set(RentingLocations().dataframe['locationId'])
-        # print(rentingIds)
-        isRenting = location_df[col].isin(rentingIds)
+        isRenting = location_df[col].isin(self.rentingIds)
         location_df = location_df[~isRenting]
         # print(location_df[col].unique())
         return location_df
 
 
-class ExtramuralLocations(QueryTable):
-    query = """
-    select 
+class ExtramuralLocations(_TreeLocations):
+    query = f"""
+    select
         l.objectId as locationId,
         l.name as locatieNaam
     from locations l
-    where l.objectId in (
-        270, # Renbaankwartier
-        98,  # Belgisch Park
-        271, # Benoordenhout
-        272, # Scheveningen Dorp
-        273  # Duindorp
-    )
+    where l.objectId in ({', '.join(sqlLiteral(id) for id in TAGS['extramural'])})
     """
 
-    def __init__(self):
-        super().__init__(query=self.query)
+    schema = {'locationId': 'int', 'locatieNaam': 'category'}
+
+    def fromTree(self, tree):
+        return tree.frame(tree.tagged('extramural'))
 
 
-class RentingLocations(QueryTable):
+class RentingLocations(_TreeLocations):
+    # locations with a name matching renting are rented out, including their afdelingen
+    renting = r'huur|prins willemhof'
     query = """
     select
         objectId as locationId,
         name as locatieNaam
-    from locations l2 
+    from locations l2
     where parentObjectId in (
         select objectId from locations l
         where name like '%Huur%'
@@ -104,43 +193,25 @@ class RentingLocations(QueryTable):
     )
     """
 
-    def __init__(self):
-        super().__init__(query=self.query)
+    schema = {'locationId': 'int', 'locatieNaam': 'category'}
 
+    def fromTree(self, tree):
+        return tree.frame(tree.subtree(tree.matching(self.renting), maxDepth=1))
 
-class LocationsForPsychogeriatric(QueryTable):
-    # 8 = Bosch en Duin: 186, 236, 213, 237, 163, 239, 230, 238
-    # 12 = Quintus: 48, 71, 111, 125
-    # 75 = het Uiterjoon: 138
-    # 489 = Zeewinde: 490, 507, 524, 533
-    query = """
+
+class LocationsForPsychogeriatric(_TreeLocations):
+    query = f"""
         select
             objectId as afdelingId,
             name as afdelingNaam
-        from locations l 
-        where objectId in (
-            490, # ZW Boswinde
-            507, # ZW Parkdael
-            524, # ZW Duinwinde
-            533, # ZW Parkzicht
-            138, # HU Het Anker
-            48,  # QS Aanlegsteiger
-            71,  # QS Loggerthe
-            111, # QS Nooder Den
-            125, # QS Zuider Den
-            186, # BD Duinrier
-            236, # BD Zeeanemoon
-            213, # BD Duinroos
-            237, # BD Zeeappel
-            163, # BD Duindoorn
-            239, # BD Zeekraal
-            230, # BD Duinviool
-            238  # BD Zee-egel
-        )
+        from locations l
+        where objectId in ({', '.join(sqlLiteral(id) for id in TAGS['psychogeriatric'])})
         """
 
-    def __init__(self):
-        super().__init__(query=self.query)
+    schema = {'afdelingId': 'int', 'afdelingNaam': 'category'}
+
+    def fromTree(self, tree):
+        return tree.frame(tree.tagged('psychogeriatric'), id='afdelingId', name='afdelingNaam')
 
 
 class Employees(QueryTable):
@@ -152,7 +223,8 @@ class Employees(QueryTable):
         where e.dateOfBirth is not Null
         """
 
+    schema = {'employeeObjectId': 'int'}
+
     def __init__(self):
-        super().__init__(query=self.query)
-        isEmpty = self.dataframe['employeeEmail'] == ""
-        self.dataframe = self.dataframe[~isEmpty]
+        super().__init__(query=self.query, lazy=True)
+        self.where("employeeEmail is null or employeeEmail <> ''")
@@ -1,84 +1,206 @@
 import configuration as config
+import documentIndex
 import pandas as pd
+import pseudonymization
+import re
 from datetime import datetime
-from configuration import conn_engine
+from clientIndex import ClientIndex
+from codeTables import DISCUSSION_TYPE, DOCUMENT_STATUS, DOCUMENT_TAG, NOTIFICATION_TYPE
+from compactTypes import compactFrame, parseDates
+from intervals import AS_OF, overlapJoin
+from latestPerKey import LatestPerKey, latestRows
 from queryTable import QueryTable
+from valueRules import ValueRules, joinedValues, multiHot
 import datasets as ds
 
 
+def _columnName(expression: str) -> str:
+    # name of the column an expression like "bsn as clientBsn" results in
+    return re.split(r"\s+as\s+", expression.strip(), flags=re.IGNORECASE)[-1]
+
+
 class ClientObjectTable(QueryTable):
     """
     - Superclass of tables that have at least one column with clientObjectId.
     - This object includes functions to add client information to the dataframe.
     """
     query = "select objectId as clientObjectId from clients"
-
-    def __init__(self, query=query):
-        super().__init__(query)
+    # client columns that can be added by name: {name: column in clients}
+    client_attributes = {
+        'identificationNo': 'identificationNo',
+        'clientBsn': 'bsn',
+        'clientName': 'name',
+        'clientGender': 'gender',
+        'clientEmail': 'emailAddress',
+        'clientMobile': 'mobilePhone'
+    }
+    # columns with personal data, replaced by pseudonyms with pseudonymize
+    pii_columns = ['identificationNo', 'clientBsn', 'clientName', 'clientEmail', 'clientMobile']
+    # types of client columns in compact mode, see compactTypes.compactFrame
+    client_schema = {'objectId': 'int', 'clientGender': 'category'}
+    # maximum number of client ids per query when reading client columns
+    chunk_size = 1000
+
+    schema = {'clientObjectId': 'int'}
+
+    def __init__(self, query=query, lazy=False):
+        super().__init__(query, lazy=lazy)
 
     @property
     # total amount of unique clients
     def total_clients(self) -> int:
-        return len(self.dataframe['clientObjectId'].unique())
+        return len(self.clientIndex)
+
+    @property
+    def clientIndex(self) -> ClientIndex:
+        """ Index on clientObjectId, rebuilt when the dataframe is replaced."""
+        dataframe = self.dataframe
+        if getattr(self, '_clientIndexOf', None) is not dataframe:
+            self._clientIndex = ClientIndex(dataframe['clientObjectId'])
+            self._clientIndexOf = dataframe
+        return self._clientIndex
 
     def lookupId(self, clientObjectId: int):
-        return self.dataframe[
-            self.dataframe['clientObjectId'] == clientObjectId]
+        return self.dataframe.iloc[self.clientIndex.positions(clientObjectId)]
+
+    def lookupIds(self, clientObjectIds):
+        """ Rows of all given clients, grouped per client in the given order."""
+        return self.dataframe.iloc[self.clientIndex.positionsOf(clientObjectIds)]
 
     def addAllClientInfo(self):
         """ Adds the following client information to the objects dataframe: identification number, BSN, name, gender, email adres, mobile phone number."""
-        self.addIdentificationNumber()
-        self.addClientBSN()
-        self.addClientName()
-        self.addClientGender()
-        self.addClientEmail()
-        self.addClientMobile()
+        self.addClientInfo(list(self.client_attributes))
 
     def addIdentificationNumber(self):
         """ Adds clients identification number to the objects dataframe."""
-        self.dataframe = self.addClientColumns("identificationNo")
+        self.addClientInfo(['identificationNo'])
 
     def addClientBSN(self):
         """ Adds clients bsn number to the objects dataframe."""
-        self.dataframe = self.addClientColumns("bsn as clientBsn")
+        self.addClientInfo(['clientBsn'])
 
     def addClientName(self):
         """ Adds clients name to the objects dataframe."""
-        self.dataframe = self.addClientColumns("name as clientName")
+        self.addClientInfo(['clientName'])
 
     def addClientGender(self):
         """ Adds clients gender to the objects dataframe."""
-        self.dataframe = self.addClientColumns("gender as clientGender")
+        self.addClientInfo(['clientGender'])
 
     def addClientEmail(self):
         """ Adds clients email to the objects dataframe."""
-        self.dataframe = self.addClientColumns("emailAddress as clientEmail")
+        self.addClientInfo(['clientEmail'])
 
     def addClientMobile(self):
         """ Adds clients mobile phone number to the objects dataframe. """
-        self.dataframe = self.addClientColumns("mobilePhone as clientMobile")
-
-    def addClientColumns(self, columns: str):
-        """ Adds columns of clients column from ONS to the objects dataframe"""
-        df = self.dataframe.merge(
-            pd.read_sql(
-                f'select objectId, {columns} from clients',
-                conn_engine
-            ),
+        self.addClientInfo(['clientMobile'])
+
+    def addClientInfo(self, columns):
+        """
+        Adds client columns to the objects dataframe with a single merge.
+
+        Parameters
+        ------
+        columns (type: list) : names from client_attributes or expressions on
+            the clients table like "bsn as clientBsn"
+        """
+        expressions = [
+            self._clientExpression(column) for column in columns]
+        expressions = [
+            expression for expression in expressions
+            if _columnName(expression) not in self.dataframe.columns]
+        if expressions:
+            self._setMergedDataframe(
+                self.addClientColumns(', '.join(expressions)))
+
+    def _clientExpression(self, column: str) -> str:
+        if column not in self.client_attributes:
+            return column
+        source = self.client_attributes[column]
+        return source if source == column else f"{source} as {column}"
+
+    def addClientColumns(self, columns: str, dataframe=None):
+        """ Adds columns of clients column from ONS to the objects dataframe, or to dataframe when given"""
+        if dataframe is None:
+            dataframe = self.dataframe
+        clientColumns = self.readClientColumns(columns, dataframe['clientObjectId'])
+        if self.compact:
+            clientColumns = compactFrame(clientColumns, self.client_schema)
+        df = dataframe.merge(
+            clientColumns,
             left_on='clientObjectId',
             right_on='objectId',
             how='left'
         )
         return df[df.columns[~pd.Series(df.columns == 'objectId')]]
 
+    def readClientColumns(self, columns: str, clientObjectIds=None):
+        """
+        Reads columns of the clients table for the clients in the objects dataframe
+        (or clientObjectIds) only. Client ids are queried in batches of chunk_size.
+        """
+        if clientObjectIds is None:
+            clientObjectIds = self.dataframe['clientObjectId']
+        ids = pd.unique(pd.Series(clientObjectIds).dropna().astype('int64'))
+        ids.sort()
+        chunks = [
+            self.readQuery(
+                f"select objectId, {columns} from clients where objectId in ("
+                + ', '.join(str(i) for i in ids[start:start + self.chunk_size])
+                + ")"
+            )
+            for start in range(0, len(ids), self.chunk_size)
+        ]
+        if not chunks:
+            return self.readQuery(f'select objectId, {columns} from clients where 1 = 0')
+        return pd.concat(chunks, ignore_index=True).drop_duplicates('objectId')
+
+    def iter_chunks(self, chunksize=100000, client_columns=None):
+        """
+        Yields the result of the query in dataframes of at most chunksize rows.
+        client_columns (see addClientInfo) are added to each chunk for the clients in that chunk.
+        """
+        expressions = None
+        if client_columns:
+            expressions = ', '.join(
+                self._clientExpression(column) for column in client_columns)
+        for chunk in super().iter_chunks(chunksize=chunksize):
+            if expressions:
+                chunk = self.addClientColumns(expressions, chunk)
+            yield chunk
+
+    def pseudonymize(self, pseudonymizer=None):
+        """
+        Replaces the columns of pii_columns in the objects dataframe by keyed pseudonyms.
+
+        Parameters
+        ------
+        pseudonymizer (type: pseudonymization.Pseudonymizer) : the one of enablePseudonyms by default
+        """
+        pseudonymizer = pseudonymizer or pseudonymization.pseudonymizer
+        if pseudonymizer is None:
+            raise ValueError("No key for pseudonyms, call pseudonymization.enablePseudonyms first")
+        self._setMergedDataframe(pseudonymizer.pseudonymizeFrame(self.dataframe, self.pii_columns))
+
     def mergeOnClientId(self, other):
-        """ Merges dataframe with other ClientObjectTables dataframe based on clientObjectId"""
-        self.dataframe = self.dataframe.merge(
+        """
+        Merges dataframe with other ClientObjectTables dataframe based on clientObjectId.
+        To combine many datasets into one row per client use featureStore.FeatureStore.
+        """
+        self._setMergedDataframe(self.dataframe.merge(
             other.dataframe,
             left_on='clientObjectId',
             right_on='clientObjectId',
             how='left'
-        )
+        ))
+
+    def _setMergedDataframe(self, merged):
+        # a left merge that didn't add rows keeps the rows in place, so the client index stays valid
+        keepIndex = getattr(self, '_clientIndexOf', None) is self.dataframe \
+            and len(merged) == len(self.dataframe)
+        self.dataframe = merged
+        if keepIndex:
+            self._clientIndexOf = merged
 
 
 class ClientsInCare(ClientObjectTable):
@@ -97,9 +219,39 @@ class ClientsInCare(ClientObjectTable):
         where dateEnd is Null
         or dateEnd > CURDATE()
         """
+    # all allocations, for derive_locally; not incremental, end dates change without a change timestamp
+    delta_query = """
+        select
+            ca.objectId,
+            ca.clientObjectId,
+            ca.createdAt,
+            ca.dateBegin as startCareDate,
+            ca.dateEnd as endCareDate
+        from care_allocations ca
+        """
+    watermark = None
+    history_query = """
+        select
+            ca.clientObjectId,
+            ca.createdAt,
+            ca.dateBegin as startCareDate,
+            ca.dateEnd as endCareDate
+        from care_allocations ca
+        """
+    period = ('startCareDate', 'endCareDate')
 
-    def __init__(self):
-        super().__init__(query=self.query)
+    schema = {
+        'clientObjectId': 'int', 'createdAt': 'date',
+        'startCareDate': 'date', 'endCareDate': 'date'
+    }
+
+    def __init__(self, lazy=False):
+        super().__init__(query=self.query, lazy=lazy)
+
+    def derive(self, rows):
+        endCareDate = parseDates(rows['endCareDate'])
+        active = endCareDate.isna() | (endCareDate > pd.Timestamp.today().normalize())
+        return rows.loc[active, ['clientObjectId', 'createdAt', 'startCareDate', 'endCareDate']]
 
 
 class LocationAssignments(ClientObjectTable):
@@ -114,63 +266,121 @@ class LocationAssignments(ClientObjectTable):
         where (endDate is NULL or endDate > CURDATE())
         and locationType LIKE 'MAIN'
         """
+    history_query = """
+        select
+            clientObjectId,
+            locationObjectId,
+            beginDate as startLocationDate,
+            endDate as endLocationDate
+        from location_assignments
+        where locationType LIKE 'MAIN'
+        """
+    period = ('startLocationDate', 'endLocationDate')
 
-    def __init__(self):
-        super().__init__(query=self.query)
+    schema = {
+        'clientObjectId': 'int', 'locationObjectId': 'int',
+        'startLocationDate': 'date', 'endLocationDate': 'date'
+    }
+
+    def __init__(self, lazy=False):
+        super().__init__(query=self.query, lazy=lazy)
 
 
 class LocationBasedClients(ClientObjectTable):
-    def __init__(self, locationTableObject, idColumn='locationId', nameColumn='locatieNaam'):
-        super().__init__()
+    dependencies = (ClientsInCare, LocationAssignments)
+    # built from the datasets below, the clients query isn't the dataset
+    streamable = False
+
+    def __init__(self, locationTableObject, idColumn='locationId', nameColumn='locatieNaam', lazy=False):
+        # dataframe is built from the datasets below in load, the clients query never runs
+        super().__init__(lazy=True)
         self.locatieNaam = nameColumn
+        self.locationTableObject = locationTableObject
+        self.idColumn = idColumn
+        if not lazy:
+            self.load()
+
+    @property
+    def location(self):
+        return self.locationTableObject.dataframe
 
-        # Get datasets
-        clients = ClientsInCare().dataframe
+    def load(self):
+        """ Combines the clients in care, their location assignments and the locations."""
+        clients = ClientsInCare(lazy=True).select(
+            ['clientObjectId', 'startCareDate', 'endCareDate']).dataframe
         assignments = LocationAssignments().dataframe
-        location = locationTableObject.dataframe
-        print(idColumn)
         # Combine clients, location and assignment datasets
         merged = assignments.merge(
-            location,
+            self.location,
             left_on='locationObjectId',
-            right_on=idColumn,
-            how='inner'
-        )
-        merged = merged.merge(
-            clients,
-            left_on='clientObjectId',
-            right_on='clientObjectId',
+            right_on=self.idColumn,
             how='inner'
         )
+        # only pairs of care and assignment periods that overlap, with the overlapping period
+        merged = overlapJoin(
+            merged, clients, 'clientObjectId',
+            ('startLocationDate', 'endLocationDate'), ('startCareDate', 'endCareDate'))
 
         # Clean merged dataset
         cols = ['clientObjectId', 'startCareDate', 'endCareDate',
-                'locationObjectId', self.locatieNaam, 'startLocationDate', 'endLocationDate']
+                'locationObjectId', self.locatieNaam, 'startLocationDate', 'endLocationDate',
+                'startOverlapDate', 'endOverlapDate']
 
-        self.dataframe = merged[cols]
-        self.dataframe = self.dataframe.drop_duplicates()
+        self.dataframe = merged[cols].drop_duplicates()
+        return self.dataframe
 
     @property
     def clientsPerLocation(self):
         return self.dataframe.groupby([self.locatieNaam]).nunique()['clientObjectId']
 
+    def asOf(self, dates):
+        """
+        Clients assigned to the locations and in care at each of dates, with the date in column asOfDate.
+        The history of assignments and care is read once for all dates, the locations are the current ones.
+        The current clients aren't needed, e.g. IntramuralClients(lazy=True).asOf(dates).
+        """
+        assignments = LocationAssignments(lazy=True).asOf(dates)
+        clients = ClientsInCare(lazy=True).asOf(dates)[
+            [AS_OF, 'clientObjectId', 'startCareDate', 'endCareDate']]
+        merged = assignments.merge(
+            self.location,
+            left_on='locationObjectId',
+            right_on=self.idColumn,
+            how='inner'
+        )
+        merged = merged.merge(clients, on=[AS_OF, 'clientObjectId'], how='inner')
+        cols = [AS_OF, 'clientObjectId', 'startCareDate', 'endCareDate',
+                'locationObjectId', self.locatieNaam, 'startLocationDate', 'endLocationDate']
+        return merged[cols].drop_duplicates()
+
+    def clientsPerLocationAsOf(self, dates):
+        """ Number of clients per location (columns) at each of dates (rows)."""
+        return self.asOf(dates).groupby([AS_OF, self.locatieNaam], observed=True)[
+            'clientObjectId'].nunique().unstack(fill_value=0)
+
 
 class IntramuralClients(LocationBasedClients):
     # clients that are assignt to an intramural location
-    def __init__(self):
+    dependencies = LocationBasedClients.dependencies + (ds.IntramuralLocations,)
+
+    def __init__(self, lazy=False):
         super().__init__(ds.IntramuralLocations(),
-                         idColumn='afdelingId', nameColumn='afdelingNaam')
+                         idColumn='afdelingId', nameColumn='afdelingNaam', lazy=lazy)
 
 
 class ExtramuralClients(LocationBasedClients):
-    def __init__(self):
-        super().__init__(ds.ExtramuralLocations())
+    dependencies = LocationBasedClients.dependencies + (ds.ExtramuralLocations,)
+
+    def __init__(self, lazy=False):
+        super().__init__(ds.ExtramuralLocations(), lazy=lazy)
 
 
 class PgClients(LocationBasedClients):
-    def __init__(self):
+    dependencies = LocationBasedClients.dependencies + (ds.LocationsForPsychogeriatric,)
+
+    def __init__(self, lazy=False):
         super().__init__(ds.LocationsForPsychogeriatric(),
-                         idColumn='afdelingId', nameColumn='afdelingNaam')
+                         idColumn='afdelingId', nameColumn='afdelingNaam', lazy=lazy)
 
 
 class Indications(ClientObjectTable):
@@ -184,68 +394,119 @@ class Indications(ClientObjectTable):
         join finance_types ft on ft.objectId = co.financeTypeObjectId
         where (co.endDate is NULL or co.endDate > CURDATE())
         """
+    history_query = """
+        select
+            co.clientObjectId,
+            ft.description as indication,
+            co.beginDate as startIndicationDate,
+            co.endDate as endIndicationDate
+        from care_orders co
+        join finance_types ft on ft.objectId = co.financeTypeObjectId
+        """
+    period = ('startIndicationDate', 'endIndicationDate')
+
+    # indications that aren't care delivered to the client
+    not_needed = ['Indicatievrije WLZ', 'Interne doorbelasting',
+                  'Niet declarabel', 'Onderaannemerschap']
+    # indications containing the first value are renamed to the second value
+    value_pairs = [
+        ('AWBZ extramuraal', 'WLZ'),
+        ('Wet maatschappelijke ondersteuning', 'WMO'),
+        ('Zorgverzekeringswet', 'ZVW'),
+        ('Paramedische Eerstelijnszorg', 'PEZ')
+    ]
+    value_rules = ValueRules(drop=not_needed, rename=value_pairs)
+    derived_frames = ('aggregated_indications',)
+
+    schema = {
+        'clientObjectId': 'int', 'indication': 'category',
+        'startIndicationDate': 'date', 'endIndicationDate': 'date'
+    }
 
     def __init__(self):
-        super().__init__(query=self.query)
+        super().__init__(query=self.query, lazy=True)
 
         # Data cleaning
-        not_needed = ['Indicatievrije WLZ', 'Interne doorbelasting',
-                      'Niet declarabel', 'Onderaannemerschap']
-
-        for nn in not_needed:
-            self.dataframe = self.dataframe[self.dataframe['indication'] != nn]
+        self.isin('indication', self.value_rules.drop, negate=True)
 
+    def transform(self, dataframe):
         # Data processing
-        value_pairs = [
-            ('AWBZ extramuraal', 'WLZ'),
-            ('Wet maatschappelijke ondersteuning', 'WMO'),
-            ('Zorgverzekeringswet', 'ZVW'),
-            ('Paramedische Eerstelijnszorg', 'PEZ')
-        ]
+        return self.value_rules.filter(dataframe, 'indication')
 
-        for (from_value, to_value) in value_pairs:
-            self.replaceValueContainedInColumn(
-                from_value, to_value, 'indication')
+    def indicationMatrix(self, sparse=False):
+        """ dataframe with a row per clientObjectId and a boolean column per indication"""
+        return multiHot(self.dataframe, 'clientObjectId', 'indication', sparse=sparse)
 
-        # dataframe with clientObejctId and indications in a list
-        self.aggregated_indications = self.dataframe[[
-            'clientObjectId', 'indication']].drop_duplicates()
-        self.aggregated_indications = self.aggregated_indications.sort_values(by=['clientObjectId', 'indication']).groupby(
-            ['clientObjectId']).agg(lambda x: ', '.join(x))['indication'].reset_index()
+    @property
+    def aggregated_indications(self):
+        """ dataframe with clientObejctId and its indications joined in alphabetical order"""
+        return joinedValues(self.indicationMatrix()).rename('indication').reset_index()
 
 
 # TODO: (LOW prioriteit)
 # Change to EEVers
 class ResponsibleEmployees(ClientObjectTable):
-    query = """
+    # most recent relation per client that is still valid
+    latest = LatestPerKey(
+        'client_employee_relations cer',
+        key='cer.clientObjectId',
+        order='cer.createdAt',
+        tiebreak='cer.objectId',
+        columns=['cer.employeeObjectId', 'cer.relationName',
+                 'cer.validFrom as startRelationDate', 'cer.validTo as endRelationDate']
+    )
+    query = latest.windowQuery(where="cer.validTo is NULL or cer.validTo > CURDATE()")
+    # all relations for derive_locally, validity is checked in derive;
+    # not incremental, validity dates change without a change timestamp
+    delta_query = latest.rowsQuery()
+    watermark = None
+    dependencies = (ds.Employees,)
+    history_query = """
         select
-            most_recent_relation.clientObjectId,
-            cer_info.employeeObjectId,
-            cer_info.relationName,
-            cer_info.validFrom as startRelationDate,
-            cer_info.validTo as endRelationDate
-        from (
-            select clientObjectId, max(createdAt) as most_recent
-            from client_employee_relations cer
-            where (cer.validTo is NULL or cer.validTo > CURDATE())
-            group by clientObjectId
-        ) most_recent_relation
-        inner join client_employee_relations cer_info on
-            cer_info.clientObjectId = most_recent_relation.clientObjectId
-            and cer_info.createdAt = most_recent_relation.most_recent
+            clientObjectId,
+            employeeObjectId,
+            relationName,
+            createdAt,
+            validFrom as startRelationDate,
+            validTo as endRelationDate
+        from client_employee_relations
         """
-
-    def __init__(self):
-        super().__init__(query=query)
-
-        employees = ds.Employees().dataframe
-        self.dataframe = self.dataframe.merge(
-            employees,
+    period = ('startRelationDate', 'endRelationDate')
+
+    schema = {
+        'clientObjectId': 'int', 'employeeObjectId': 'int', 'relationName': 'category',
+        'startRelationDate': 'date', 'endRelationDate': 'date'
+    }
+
+    def __init__(self, lazy=False):
+        super().__init__(query=self.query, lazy=lazy)
+
+    def transform(self, dataframe):
+        """ Adds the employees, also to every chunk of iter_chunks and to the history of asOf."""
+        # selected columns without employeeObjectId can't be matched to employees
+        if 'employeeObjectId' not in dataframe.columns:
+            return dataframe
+        if getattr(self, '_employees', None) is None:
+            self._employees = ds.Employees().dataframe
+        return dataframe.merge(
+            self._employees,
             left_on='employeeObjectId',
             right_on='employeeObjectId',
             how='left'
         )
 
+    def derive(self, rows):
+        endRelationDate = parseDates(rows['endRelationDate'])
+        valid = endRelationDate.isna() | (endRelationDate > pd.Timestamp.today().normalize())
+        return self.latest.pick(rows[valid])
+
+    def deriveAsOf(self, rows):
+        # most recent relation per client among the relations valid and known at the date
+        known = parseDates(rows['createdAt']) <= rows[AS_OF]
+        latest = rows[known].sort_values([AS_OF, 'clientObjectId', 'createdAt'], kind='stable')
+        latest = latest.drop_duplicates([AS_OF, 'clientObjectId'], keep='last')
+        return latest.drop(columns='createdAt').reset_index(drop=True)
+
 
 class LegalRepresentative(ClientObjectTable):
     query = """
@@ -267,6 +528,15 @@ class LegalRepresentative(ClientObjectTable):
     left join addresses a on ra.addressObjectId = a.objectId
     where nccrt.name like '%wettelijke%'
     """
+    # not incremental: r.updatedAt doesn't change with the phone numbers and email of the addresses
+    pii_columns = ClientObjectTable.pii_columns + [
+        'fistNameWV', 'prefixWV', 'birthnameWV', 'telephoneNumber', 'telephoneNumber2', 'email'
+    ]
+
+    schema = {
+        'clientObjectId': 'int', 'relatieType': 'category',
+        'relatieCategorie': 'category', 'updatedAt': 'date'
+    }
 
     def __init__(self):
         super().__init__(query=self.query)
@@ -291,26 +561,21 @@ class ActiveCareplans(ClientObjectTable):
 #     and c.endDate >= CURDATE()
 #     """
 
+    schema = {
+        'clientObjectId': 'int', 'careplanId': 'int', 'careplanEmployee': 'int',
+        'startCareplanDate': 'date', 'endCareplanDate': 'date',
+        'discussionType': 'category'
+    }
+
     def __init__(self):
         super().__init__(query=self.query)
-        self._prepareDiscussionType()
-
-    def _prepareDiscussionType(self):
-        _DISCUSSIONTYPE = 'discussionType'
-        isBesprokenEnAkkoord = self.dataframe[_DISCUSSIONTYPE] == 0
-        self.dataframe.loc[
-            isBesprokenEnAkkoord,
-            _DISCUSSIONTYPE] = 'Is besproken en akkoord'
-        wordtLaterBesproken = self.dataframe[_DISCUSSIONTYPE] == 1
-        self.dataframe.loc[
-            wordtLaterBesproken,
-            _DISCUSSIONTYPE] = 'wordt later besproken'
-        wordtNietBesproken = self.dataframe[_DISCUSSIONTYPE] == 2
-        self.dataframe.loc[
-            wordtNietBesproken,
-            _DISCUSSIONTYPE] = 'wordt niet besproken'
-        nietAkkoord = self.dataframe[_DISCUSSIONTYPE] == 3
-        self.dataframe.loc[nietAkkoord, _DISCUSSIONTYPE] = 'niet akkoord'
+
+    def transform(self, dataframe):
+        return self._prepareDiscussionType(dataframe)
+
+    def _prepareDiscussionType(self, dataframe):
+        dataframe['discussionType'] = DISCUSSION_TYPE.decode(dataframe['discussionType'])
+        return dataframe
 
 
 class WithFirstCareplan(ClientObjectTable):
@@ -332,25 +597,25 @@ class WithFirstCareplan(ClientObjectTable):
 #     left join dossier_care_plan_signatures dcps on dcps.carePlanObjectId = oldest_cp.objectId
 #     left join dossier_care_plan_signature_metadata dcpsm on dcpsm.carePlanObjectId = oldest_cp.objectId
 #     """
-    query = """
-    select
-        doc_info.clientObjectId,
-        doc_info.employeeObjectId,
-        doc_info.filename,
-        doc_info.status,
-        doc_info.updatedAt
-    from (
-        select d.objectId, max(d.updatedAt) as most_recent
-        from document_tags dt
-        join documents d on d.objectId = dt.documentObjectId
-        # tag 14 = zorgovereenkomst
-        where dt.tagObjectId = 32
-        group by clientObjectId
-    ) as mr
-    inner join documents doc_info on
-        doc_info.objectId = mr.objectId
-        and doc_info.updatedAt = mr.most_recent
-    """
+    # most recent zorgplan document per client
+    latest = LatestPerKey(
+        'document_tags dt\n    join documents d on d.objectId = dt.documentObjectId',
+        key='d.clientObjectId',
+        order='d.updatedAt',
+        tiebreak='d.objectId',
+        columns=['d.employeeObjectId', 'd.filename', 'd.status', 'd.updatedAt'],
+        where=DOCUMENT_TAG.condition('dt.tagObjectId', 'zorgplan')
+    )
+    query = latest.windowQuery()
+
+    dependencies = (ActiveCareplans,)
+
+    delta_query = latest.rowsQuery()
+
+    schema = {
+        'clientObjectId': 'int', 'employeeObjectId': 'int',
+        'status': 'int', 'updatedAt': 'date'
+    }
 
     def __init__(self):
         super().__init__(query=self.query)
@@ -361,56 +626,65 @@ class WithFirstCareplan(ClientObjectTable):
             how='left'
         )
 
+    def derive(self, rows):
+        return self.latest.pick(rows)
+
 
 class Careagreements(ClientObjectTable):
-    query = """
-    select
-        doc_info.clientObjectId,
-        doc_info.employeeObjectId,
-        doc_info.filename,
-        doc_info.status,
-        doc_info.updatedAt
-    from (
-        select d.objectId, max(d.updatedAt) as most_recent
-        from document_tags dt
-        join documents d on d.objectId = dt.documentObjectId
-        # tag 14 = zorgovereenkomst
-        where dt.tagObjectId = 14
-        group by clientObjectId
-    ) as mr
-    inner join documents doc_info on
-        doc_info.objectId = mr.objectId
-        and doc_info.updatedAt = mr.most_recent
-    """
+    # most recent zorgovereenkomst document per client
+    latest = LatestPerKey(
+        'document_tags dt\n    join documents d on d.objectId = dt.documentObjectId',
+        key='d.clientObjectId',
+        order='d.updatedAt',
+        tiebreak='d.objectId',
+        columns=['d.employeeObjectId', 'd.filename', 'd.status', 'd.updatedAt'],
+        where=DOCUMENT_TAG.condition('dt.tagObjectId', 'zorgovereenkomst')
+    )
+    query = latest.windowQuery()
+    delta_query = latest.rowsQuery()
+
+    schema = {
+        'clientObjectId': 'int', 'employeeObjectId': 'int',
+        'status': 'int', 'updatedAt': 'date'
+    }
 
     def __init__(self):
-        super().__init__(query=self.query)
-        self.dataframe['Getekend'] = self.dataframe['filename'].str.contains(
-            'getekend')
+        super().__init__(query=self.query, lazy=True)
+
+    def derive(self, rows):
+        return self.latest.pick(rows)
+
+    def transform(self, dataframe):
+        dataframe['Getekend'] = documentIndex.keywordFlags(dataframe['filename'], {'Getekend': 'getekend'})['Getekend']
+        return dataframe
 
 
 class Notifications(ClientObjectTable):
-    query = """
-    select
-        mr.clientObjectId,
-        n_info.createdAt,
-        n_info.title,
-        n_info.subtitle
-    from (
-        select clientObjectId, max(createdAt) as most_recent
-        from notifications n
-        # client in zorg opgenomen = 152
-        where n.notificationTypeObjectId = 152
-        group by clientObjectId
-    ) mr
-    inner join notifications n_info on
-        mr.clientObjectId = n_info.clientObjectId
-        and mr.most_recent = n_info.createdAt
-    """
+    # most recent notification per client that the client is taken into care
+    latest = LatestPerKey(
+        'notifications n',
+        key='n.clientObjectId',
+        order='n.createdAt',
+        tiebreak='n.objectId',
+        columns=['n.createdAt', 'n.title', 'n.subtitle'],
+        where=NOTIFICATION_TYPE.condition('n.notificationTypeObjectId', 'client in zorg opgenomen')
+    )
+    query = latest.windowQuery()
+    delta_query = latest.rowsQuery()
+    watermark = 'createdAt'
+
+    schema = {
+        'clientObjectId': 'int', 'createdAt': 'date',
+        # subtitle is free text with many distinct values, it stays a string
+        'title': 'category'
+    }
 
     def __init__(self):
         super().__init__(query=self.query)
 
+    def derive(self, rows):
+        return self.latest.pick(rows)
+
 
 if __name__ == "__main__":
     intramuraalClients = IntramuraalClients()
@@ -418,18 +692,47 @@ if __name__ == "__main__":
 
 
 class Rekenmodule(ClientObjectTable):
-    query = """
+    query = f"""
     select
         d.clientObjectId,
-        d.updatedAt # meest recent
+        max(d.updatedAt) as updatedAt # meest recent, like derive
     from documents d
     where (
         filename like '%rekenmodule%'
         or description like '%rekenmodule%'
-    ) and status != 3 #verwijderd
+    ) and {DOCUMENT_STATUS.condition('status', 'verwijderd', negate=True)}
     group by d.clientObjectId
     """
+    # without the status filter, so documents that are deleted later are refreshed as well
+    delta_query = """
+    select
+        d.objectId,
+        d.clientObjectId,
+        d.status,
+        d.updatedAt
+    from documents d
+    where (
+        filename like '%rekenmodule%'
+        or description like '%rekenmodule%'
+    )
+    """
+
+    schema = {'clientObjectId': 'int', 'updatedAt': 'date'}
 
     def __init__(self):
-        super().__init__(query=self.query)
-        self.dataframe['Rekenmodule'] = True
+        super().__init__(query=self.query, lazy=True)
+
+    def localRows(self):
+        # documents mentioning the rekenmodule from the document index, instead of a LIKE scan
+        if documentIndex.index is None:
+            return None
+        return documentIndex.index.refresh(self.conn_engine).matching('rekenmodule')
+
+    def derive(self, rows):
+        rows = rows[~rows['status'].isin(DOCUMENT_STATUS.codes('verwijderd'))]
+        latest = latestRows(rows, 'updatedAt', tiebreak='objectId')
+        return latest[['clientObjectId', 'updatedAt']]
+
+    def transform(self, dataframe):
+        dataframe['Rekenmodule'] = True
+        return dataframe
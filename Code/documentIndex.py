@@ -0,0 +1,257 @@
+"""
+Inverted index of the words in the filenames and descriptions of documents, kept locally.
+
+    documentIndex.enableIndex('Output/document_index')
+    index = documentIndex.index.refresh()
+    index.matching('rekenmodule')                                  # documents mentioning a word
+    index.classify({'Rekenmodule': 'rekenmodule', 'Getekend': ['getekend', 'ondertekend']})
+
+A term matches every word it is part of, like LIKE '%term%' ignoring case, but only the
+distinct words are searched instead of every filename. The first refresh reads the documents
+table, later refreshes only the documents updated since the last one.
+"""
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+import queryTable
+
+# Opt-in index used by the document datasets, see enableIndex
+index = None
+
+# metadata of every indexed document
+COLUMNS = ['objectId', 'clientObjectId', 'status', 'updatedAt']
+
+DOCUMENTS_QUERY = """
+select
+    d.objectId,
+    d.clientObjectId,
+    d.status,
+    d.updatedAt,
+    d.filename,
+    d.description
+from documents d
+"""
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def enableIndex(directory, full_refresh_after=7 * 24 * 60 * 60, refresh_after=60):
+    """
+    Keeps an index of the documents table in directory and lets Rekenmodule and Careagreements use it.
+
+    Parameters
+    ------
+    directory (type: string) : folder with the index, created when missing
+    full_refresh_after (type: int) : seconds after which the index is rebuilt, picking up removed documents
+    refresh_after (type: int) : seconds a refresh stays current, datasets of one build share a refresh
+    """
+    global index
+    index = DocumentIndex(directory, full_refresh_after=full_refresh_after, refresh_after=refresh_after)
+    return index
+
+
+def disableIndex():
+    global index
+    index = None
+
+
+def words(texts) -> pd.DataFrame:
+    """
+    Lower case words of texts as (position, word) rows, without repeated words per text.
+    Every distinct text is split once.
+    """
+    codes, uniques = pd.factorize(pd.Series(texts, dtype=object).fillna('').astype(str).str.lower())
+    split = [_WORD.findall(text) for text in uniques]
+    counts = np.fromiter(map(len, split), dtype=np.int64, count=len(split))
+    textWords = pd.DataFrame({
+        'text': np.repeat(np.arange(len(uniques)), counts),
+        'word': [word for textWords in split for word in textWords]
+    }).drop_duplicates()
+    positions = pd.DataFrame({'position': np.arange(len(codes)), 'text': codes})
+    return positions.merge(textWords, on='text')[['position', 'word']].reset_index(drop=True)
+
+
+def _terms(keywords) -> dict:
+    # {flag: [terms]} in lower case
+    return {
+        flag: [term.lower() for term in ([terms] if isinstance(terms, str) else terms)]
+        for flag, terms in keywords.items()
+    }
+
+
+def _wordFlags(vocabulary, keywords) -> np.ndarray:
+    # (word, flag) matrix of which words match a term of each flag
+    vocabulary = pd.Index(vocabulary, dtype=object).astype(str)
+    flags = np.zeros((len(vocabulary), len(keywords)), dtype=bool)
+    for column, terms in enumerate(keywords.values()):
+        for term in terms:
+            flags[:, column] |= vocabulary.str.contains(term, regex=False)
+    return flags
+
+
+def keywordFlags(texts, keywords) -> pd.DataFrame:
+    """
+    A boolean column per flag of keywords ({flag: term or list of terms}), True for texts
+    containing one of its terms, without an index. Texts are split and matched once for all flags.
+    """
+    keywords = _terms(keywords)
+    texts = pd.Series(texts)
+    found = words(texts)
+    word = found['word'].astype('category')
+    hits = _wordFlags(word.cat.categories, keywords)[word.cat.codes.to_numpy()]
+    flags = np.zeros((len(texts), len(keywords)), dtype=bool)
+    for column in range(len(keywords)):
+        flags[found['position'].to_numpy()[hits[:, column]], column] = True
+    return pd.DataFrame(flags, index=texts.index, columns=list(keywords))
+
+
+class DocumentIndex(object):
+    """
+    Documents with their metadata (COLUMNS) and the words of their filename and description.
+
+    - documents has a row per document, postings a row per (objectId, word).
+    - refresh reads the documents updated since the last refresh and only splits those.
+    - classify finds the words matching the terms of all flags in the distinct words,
+      then marks the documents with those words in one pass over postings.
+    """
+    _STATE = 'state.json'
+    _DOCUMENTS = 'documents.parquet'
+    _POSTINGS = 'postings.parquet'
+
+    def __init__(self, directory=None, full_refresh_after=7 * 24 * 60 * 60, refresh_after=60):
+        self.directory = None if directory is None else pathlib.Path(directory)
+        self.full_refresh_after = full_refresh_after
+        self.refresh_after = refresh_after
+        self.documents = pd.DataFrame({column: pd.Series(dtype=object) for column in COLUMNS})
+        self.postings = pd.DataFrame({'objectId': pd.Series(dtype=np.int64), 'word': pd.Series(dtype='category')})
+        self.state = {'full_load': 0, 'refreshed': 0, 'watermark': None}
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._read()
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def watermark(self):
+        """ Highest updatedAt in the index, None when empty."""
+        return None if self.state['watermark'] is None else pd.Timestamp(self.state['watermark'])
+
+    @property
+    def vocabulary(self) -> pd.Index:
+        """ Distinct words in the index."""
+        return self.postings['word'].cat.categories
+
+    def update(self, rows):
+        """ Adds rows of DOCUMENTS_QUERY, replacing the indexed documents with the same objectId."""
+        rows = rows.drop_duplicates('objectId', keep='last').reset_index(drop=True)
+        found = words(rows['filename'].fillna('').astype(str) + ' ' + rows['description'].fillna('').astype(str))
+        postings = pd.DataFrame({
+            'objectId': rows['objectId'].to_numpy(dtype=np.int64)[found['position'].to_numpy()],
+            'word': found['word']
+        })
+        changed = pd.Index(rows['objectId'].to_numpy(dtype=np.int64))
+        with self._lock:
+            if len(self.documents):
+                kept = ~self.documents['objectId'].isin(changed)
+                documents = pd.concat([self.documents[kept], rows[COLUMNS]], ignore_index=True)
+                kept = ~self.postings['objectId'].isin(changed)
+                postings = pd.concat([self.postings[kept], postings], ignore_index=True)
+            else:
+                documents = rows[COLUMNS]
+            self.documents = documents
+            self.postings = postings.astype({'word': 'category'})
+            watermark = pd.to_datetime(documents['updatedAt']).max()
+            self.state['watermark'] = None if pd.isna(watermark) else watermark.isoformat()
+        return self
+
+    def refresh(self, conn_engine=None, full=False):
+        """
+        Reads the documents updated since the last refresh from the database, or all documents
+        when the index is empty, full is set or the last full load is full_refresh_after seconds ago.
+        Skipped within refresh_after seconds of the last refresh.
+        """
+        # datasets built concurrently share one refresh
+        with self._refreshing:
+            now = time.time()
+            full = full or self.watermark is None or now - self.state['full_load'] > self.full_refresh_after
+            if not full and now - self.state['refreshed'] < self.refresh_after:
+                return self
+            reader = queryTable.QueryTable(DOCUMENTS_QUERY, conn_engine=conn_engine, lazy=True)
+            if full:
+                rows = reader.executeQuery(DOCUMENTS_QUERY)
+                with self._lock:
+                    self.documents = self.documents.iloc[:0]
+                    self.postings = self.postings.iloc[:0]
+                self.state['full_load'] = now
+            else:
+                # documents at the watermark itself are read again, they may have been committed after the last refresh
+                since = self.watermark.isoformat(sep=' ')
+                rows = reader.executeQuery(f"select * from (\n{DOCUMENTS_QUERY}\n) as q\nwhere updatedAt >= '{since}'")
+            with instrumentation.span('DocumentIndex', 'refresh') as span:
+                self.update(rows)
+                span.set(full=full, rows=len(rows), documents=len(self))
+            self.state['refreshed'] = now
+            if self.directory is not None:
+                self._write()
+        return self
+
+    def classify(self, keywords, documents=None) -> pd.DataFrame:
+        """
+        documents (all indexed documents by default) with a boolean column per flag of keywords,
+        {flag: term or list of terms}, True when a word of the document contains one of its terms.
+        """
+        keywords = _terms(keywords)
+        documents = self.documents if documents is None else documents
+        with self._lock:
+            postings = self.postings
+        hits = _wordFlags(postings['word'].cat.categories, keywords)[postings['word'].cat.codes.to_numpy()]
+        matched = hits.any(axis=1)
+        positions = pd.Index(documents['objectId'].to_numpy(dtype=np.int64)).get_indexer(
+            postings['objectId'].to_numpy()[matched])
+        hits = hits[matched][positions >= 0]
+        positions = positions[positions >= 0]
+        flags = np.zeros((len(documents), len(keywords)), dtype=bool)
+        for column in range(len(keywords)):
+            flags[positions[hits[:, column]], column] = True
+        return documents.assign(**{flag: flags[:, column] for column, flag in enumerate(keywords)})
+
+    def matching(self, *terms) -> pd.DataFrame:
+        """ Documents with a word containing one of terms."""
+        flagged = self.classify({'matching': list(terms)})
+        return flagged[flagged.pop('matching')].reset_index(drop=True)
+
+    def _read(self):
+        try:
+            with open(self.directory / self._STATE) as file:
+                state = json.load(file)
+            documents = pd.read_parquet(self.directory / self._DOCUMENTS)
+            postings = pd.read_parquet(self.directory / self._POSTINGS)
+        except (OSError, ValueError):
+            return
+        self.state = state
+        self.documents = documents
+        self.postings = postings.astype({'word': 'category'})
+
+    def _write(self):
+        with self._lock:
+            documents, postings, state = self.documents, self.postings, dict(self.state)
+        postings = postings.assign(word=postings['word'].cat.remove_unused_categories())
+        for frame, name in ((documents, self._DOCUMENTS), (postings, self._POSTINGS)):
+            tmp = self.directory / (name + '.tmp')
+            frame.to_parquet(tmp, index=False)
+            os.replace(tmp, self.directory / name)
+        tmp = self.directory / (self._STATE + '.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp, self.directory / self._STATE)
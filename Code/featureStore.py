@@ -0,0 +1,133 @@
+"""
+Features of clients from many datasets, aligned to one array of clients.
+
+    store = FeatureStore.fromDataset(IntramuralClients())
+    store.add(Indications(), columns=['indication'], fanout='list')
+    store.add(ResponsibleEmployees(), columns=['employeeObjectId', 'relationName'])
+    store.add(Careagreements(), columns=['Getekend', 'updatedAt'], prefix='careagreement_')
+    modelingTable = store.frame()
+
+Every dataset is aligned to the clients once: one row position per client, chosen by the fan-out
+rule of the dataset. Columns stay in their dataset until frame gathers the requested features at
+those positions, so no intermediate merged frames are built and no client ends up in several rows.
+"""
+import numpy as np
+import pandas as pd
+
+from clientIndex import ClientIndex
+from intervals import expandRanges
+
+# How rows of a client with several rows become one:
+# - 'unique': a client with several rows is an error
+# - 'first', 'latest': the first or last row of the client in order (or in the order of the dataset)
+# - 'list': a list of the values of all rows of the client
+FANOUTS = ('unique', 'first', 'latest', 'list')
+
+
+class FeatureStore(object):
+    """
+    Features (columns) of the sorted unique clients in clientObjectIds.
+
+    - add aligns a dataset to the clients and registers its columns as features.
+    - frame returns the requested features with one row per client, in one gather per column.
+    """
+
+    def __init__(self, clientObjectIds):
+        ids = pd.to_numeric(pd.Series(clientObjectIds).dropna()).to_numpy(dtype=np.int64)
+        self.clientObjectIds = np.unique(ids)
+        # {feature: (values of the dataset, position of every client in values, -1 for none)}
+        self._features = {}
+
+    @classmethod
+    def fromDataset(cls, dataset, key='clientObjectId'):
+        """ Store of the clients in dataset (a ClientObjectTable or dataframe)."""
+        return cls(_dataframe(dataset)[key])
+
+    def __len__(self):
+        return len(self.clientObjectIds)
+
+    def __contains__(self, feature):
+        return feature in self._features
+
+    @property
+    def features(self) -> list:
+        return list(self._features)
+
+    def add(self, dataset, columns=None, fanout='unique', order=None, key='clientObjectId', prefix=''):
+        """
+        Adds columns of dataset as features named prefix + column.
+
+        Parameters
+        ------
+        dataset : ClientObjectTable or dataframe with column key
+        columns (type: list) : columns to add, all but key by default
+        fanout (type: string) : rule for clients with several rows, see FANOUTS
+        order (type: string) : column ordering the rows of a client for 'first', 'latest' and 'list'
+        """
+        if fanout not in FANOUTS:
+            raise ValueError(f"Unknown fanout {fanout}, use one of {FANOUTS}")
+        dataframe = _dataframe(dataset)
+        if columns is None:
+            columns = [column for column in dataframe.columns if column != key]
+        names = [prefix + column for column in columns]
+        existing = [name for name in names if name in self._features]
+        if existing:
+            raise ValueError(f"Features {existing} already exist, add them with a prefix")
+        if order is not None:
+            dataframe = dataframe.sort_values(order, kind='stable', na_position='first')
+
+        index = ClientIndex(dataframe[key])
+        slots = np.searchsorted(index.keys, self.clientObjectIds)
+        found = slots < len(index.keys)
+        found[found] = index.keys[slots[found]] == self.clientObjectIds[found]
+        slots = np.where(found, slots, 0)
+        counts = np.where(found, index.counts[slots] if len(index.keys) else 0, 0)
+
+        if fanout == 'unique' and (counts > 1).any():
+            raise ValueError(
+                f"{(counts > 1).sum()} clients have several rows in {_name(dataset)}, "
+                "choose a fanout of 'first', 'latest' or 'list'")
+        if fanout == 'list':
+            for column, name in zip(columns, names):
+                self._features[name] = (_lists(dataframe[column].to_numpy(), index, slots, counts), None)
+            return self
+        last = counts - 1 if fanout == 'latest' else 0
+        positions = np.where(counts > 0, index.rows[index.starts[slots] + last] if len(index.keys) else 0, -1)
+        for column, name in zip(columns, names):
+            self._features[name] = (dataframe[column].array, positions)
+        return self
+
+    def frame(self, features=None, key='clientObjectId') -> pd.DataFrame:
+        """ Dataframe with a row per client and the features (all by default) as columns."""
+        features = self.features if features is None else list(features)
+        unknown = [feature for feature in features if feature not in self._features]
+        if unknown:
+            raise KeyError(f"Unknown features {unknown}, the store has {self.features}")
+        columns = {key: self.clientObjectIds}
+        for feature in features:
+            values, positions = self._features[feature]
+            columns[feature] = values if positions is None else _gather(values, positions)
+        return pd.DataFrame(columns)
+
+
+def _dataframe(dataset) -> pd.DataFrame:
+    return dataset if isinstance(dataset, pd.DataFrame) else dataset.dataframe
+
+
+def _name(dataset) -> str:
+    return 'the dataframe' if isinstance(dataset, pd.DataFrame) else type(dataset).__name__
+
+
+def _gather(values, positions):
+    # values at positions, missing for -1; integers and booleans become nullable instead of float
+    if (positions < 0).any() and isinstance(values, pd.arrays.NumpyExtensionArray) and values.dtype.kind in 'iub':
+        values = pd.array(values.to_numpy())
+    return values.take(positions, allow_fill=True)
+
+
+def _lists(values, index, slots, counts) -> np.ndarray:
+    # list of the values of every client, in the order of its rows; empty for clients without rows
+    rows = index.rows[expandRanges(index.starts[slots], counts)]
+    result = np.empty(len(counts), dtype=object)
+    result[:] = [list(part) for part in np.split(values[rows], np.cumsum(counts)[:-1])]
+    return result
@@ -0,0 +1,113 @@
+import json
+import os
+import pathlib
+import threading
+import time
+
+import pandas as pd
+from queryCache import queryKey
+
+
+class SnapshotStore(object):
+    """
+    Stores the source rows of datasets with a change timestamp (watermark) on disk.
+
+    - The first refresh of a dataset reads all rows of its delta_query.
+    - Following refreshes only read rows with a watermark at or after the highest
+      watermark seen, and replace the stored rows with the same primary_key.
+    - Changes that don't update the watermark, like deleted rows, are picked up by
+      a full reload after full_refresh_after seconds or after reset().
+    """
+    _STATE = 'state.json'
+
+    def __init__(self, directory, full_refresh_after=7 * 24 * 60 * 60):
+        self.directory = pathlib.Path(directory)
+        self.full_refresh_after = full_refresh_after
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._state = self._readState()
+        self._lock = threading.Lock()
+        self._datasetLocks = {}
+
+    def rows(self, dataset):
+        """ Refreshes the stored rows of a dataset object and returns them."""
+        name = type(dataset).__name__
+        path = self.directory / f"{name}.parquet"
+        with self._lock:
+            lock = self._datasetLocks.setdefault(name, threading.Lock())
+        # datasets are refreshed concurrently, a single dataset one refresh at a time
+        with lock:
+            state = self._state.get(name)
+            query = queryKey(dataset.delta_query)
+            full = (
+                state is None
+                or not path.exists()
+                or state['query'] != query
+                or time.time() - state['full_load'] > self.full_refresh_after
+            )
+            if full:
+                rows = self._read(dataset, dataset.delta_query)
+                state = {'query': query, 'full_load': time.time(), 'watermark': None}
+            else:
+                since = pd.Timestamp(state['watermark'])
+                delta = self._read(dataset, self.deltaQuery(dataset, since))
+                rows = pd.concat([pd.read_parquet(path), delta], ignore_index=True)
+                # rows from the delta replace their stored version
+                rows = rows.drop_duplicates(dataset.primary_key, keep='last')
+                rows = rows.reset_index(drop=True)
+            watermark = pd.to_datetime(rows[dataset.watermark]).max()
+            if not pd.isna(watermark):
+                state['watermark'] = watermark.isoformat()
+            elif state['watermark'] is None:
+                # nothing to refresh from yet
+                state['full_load'] = 0
+            tmp = path.with_suffix('.tmp')
+            rows.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+            with self._lock:
+                self._state[name] = state
+                self._writeState()
+        return rows
+
+    @staticmethod
+    def deltaQuery(dataset, since) -> str:
+        """ delta_query of dataset restricted to rows changed since the watermark."""
+        # rows at the watermark itself are read again, they may have been committed after the last refresh
+        return f"select * from (\n{dataset.delta_query}\n) as q\nwhere {dataset.watermark} >= '{since.isoformat(sep=' ')}'"
+
+    def reset(self, dataset=None):
+        """ Forces a full reload of a dataset (class or name), or of all datasets."""
+        with self._lock:
+            if dataset is None:
+                names = list(self._state)
+            else:
+                names = [getattr(dataset, '__name__', dataset)]
+            for name in names:
+                self._state.pop(name, None)
+                path = self.directory / f"{name}.parquet"
+                if path.exists():
+                    path.unlink()
+            self._writeState()
+
+    def watermark(self, dataset):
+        """ Highest watermark stored for a dataset (class or name), None before the first refresh."""
+        state = self._state.get(getattr(dataset, '__name__', dataset))
+        if state is None or state['watermark'] is None:
+            return None
+        return pd.Timestamp(state['watermark'])
+
+    def _read(self, dataset, query):
+        # directly from the database, results of delta queries aren't worth caching
+        return dataset.executeQuery(query)
+
+    def _readState(self):
+        try:
+            with open(self.directory / self._STATE) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _writeState(self):
+        tmp = self.directory / (self._STATE + '.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(self._state, file)
+        os.replace(tmp, self.directory / self._STATE)
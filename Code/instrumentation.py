@@ -0,0 +1,239 @@
+"""
+Structured timing and size metrics of dataset builds.
+
+Nothing is recorded until a sink is added:
+
+    import instrumentation
+    report = instrumentation.addSink(instrumentation.MemorySink())
+    IntramuralClients()
+    report.summary()
+
+Every dataset build, load, query and connection checkout is a span. Spans
+started while another span of the same thread is open are nested in it, so
+composite datasets like LocationBasedClients show which part took the time.
+"""
+import functools
+import itertools
+import json
+import logging
+import threading
+import time
+
+
+_sinks = []
+_local = threading.local()
+_ids = itertools.count(1)
+# {dataset class: its own __init__}, wrapped in tracedInit only while there are sinks, see traceInit
+_inits = {}
+
+
+def addSink(sink):
+    """ Sends all following spans to sink, returns the sink."""
+    if not _sinks:
+        _wrapInits(True)
+    _sinks.append(sink)
+    return sink
+
+
+def removeSink(sink):
+    _sinks.remove(sink)
+    if not _sinks:
+        _wrapInits(False)
+
+
+def clearSinks():
+    del _sinks[:]
+    _wrapInits(False)
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def currentSpan():
+    """ Innermost open span of the calling thread, or None."""
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+class Span(object):
+    """
+    Time between entering and leaving a with-block, with metrics added by set.
+    Emitted to all sinks when the block ends.
+    """
+
+    def __init__(self, name, kind, owner=None, **metrics):
+        self.name = name
+        self.kind = kind
+        self.owner = owner
+        self.metrics = metrics
+        self.id = next(_ids)
+        self.parent = None
+        self.depth = 0
+
+    def set(self, **metrics):
+        self.metrics.update(metrics)
+
+    def describe(self, dataframe):
+        """ Adds the size of dataframe to the metrics."""
+        if dataframe is not None:
+            self.set(rows=len(dataframe), columns=len(dataframe.columns),
+                     memory_bytes=int(dataframe.memory_usage(deep=True).sum()))
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            self.parent = stack[-1].id
+            self.depth = stack[-1].depth + 1
+        stack.append(self)
+        self.start = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self._start
+        _local.stack.pop()
+        record = {
+            'id': self.id,
+            'parent': self.parent,
+            'depth': self.depth,
+            'name': self.name,
+            'kind': self.kind,
+            'thread': threading.current_thread().name,
+            'start': self.start,
+            'seconds': seconds,
+            'error': None if exc_type is None else exc_type.__name__
+        }
+        record.update(self.metrics)
+        for sink in list(_sinks):
+            sink.emit(record)
+
+
+class _NoSpan(object):
+    # used while no sinks are added, so tracing costs nothing
+    def set(self, **metrics):
+        pass
+
+    def describe(self, dataframe):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, kind='span', owner=None, **metrics):
+    """ Span to use in a with-block, does nothing when there are no sinks."""
+    if not _sinks:
+        return _NO_SPAN
+    return Span(name, kind, owner=owner, **metrics)
+
+
+def tracedInit(init):
+    """
+    Wraps the __init__ of a dataset class in a 'dataset' span.
+    Base class __init__s called by the same object are part of the same span.
+    """
+    @functools.wraps(init)
+    def wrapper(self, *args, **kwargs):
+        current = currentSpan()
+        if not _sinks or (current is not None and current.owner is self):
+            return init(self, *args, **kwargs)
+        with Span(type(self).__name__, 'dataset', owner=self) as datasetSpan:
+            init(self, *args, **kwargs)
+            datasetSpan.describe(getattr(self, '_dataframe', None))
+    return wrapper
+
+
+def traceInit(cls):
+    """
+    Makes every build of dataset class cls a 'dataset' span while there are sinks.
+    Without sinks cls keeps its own __init__, so tracing costs nothing.
+    """
+    if '__init__' not in cls.__dict__:
+        return
+    _inits[cls] = cls.__dict__['__init__']
+    if _sinks:
+        cls.__init__ = tracedInit(_inits[cls])
+
+
+def _wrapInits(traced):
+    for cls, init in list(_inits.items()):
+        cls.__init__ = tracedInit(init) if traced else init
+
+
+class LogSink(object):
+    """ Logs every span as a line of json."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('instrumentation')
+        self.level = level
+
+    def emit(self, record):
+        self.logger.log(self.level, json.dumps(record, default=str))
+
+
+class JsonLinesSink(object):
+    """ Appends every span to a json lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.path, 'a') as file:
+                file.write(line + '\n')
+
+
+class MemorySink(object):
+    """ Keeps all spans in memory for a report."""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def clear(self):
+        self.records = []
+
+    def report(self):
+        """
+        Dataframe with a row per span in the order they started.
+        self_seconds is the time not spent in nested spans, e.g. pandas processing of a dataset.
+        """
+        import pandas as pd
+        report = pd.DataFrame(self.records)
+        if report.empty:
+            return report
+        report['parent'] = report['parent'].astype('Int64')
+        nested = report.groupby('parent')['seconds'].sum()
+        report['self_seconds'] = report['seconds'] - report['id'].map(nested).fillna(0)
+        return report.sort_values('start').reset_index(drop=True)
+
+    def summary(self):
+        """
+        Time per span name and kind, ordered by the time spent in the spans themselves,
+        with the share of the total time of all top level spans.
+        """
+        report = self.report()
+        if report.empty:
+            return report
+        total = report.loc[report['parent'].isna(), 'seconds'].sum()
+        summary = report.groupby(['kind', 'name']).agg(
+            count=('id', 'size'),
+            seconds=('seconds', 'sum'),
+            self_seconds=('self_seconds', 'sum'),
+            rows=('rows', 'max') if 'rows' in report else ('id', 'size')
+        ).sort_values('self_seconds', ascending=False)
+        summary['share'] = summary['self_seconds'] / total if total else 0.0
+        return summary
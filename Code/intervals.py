@@ -0,0 +1,133 @@
+"""
+Vectorized operations on rows with a period, like care allocations and location assignments.
+
+A row is active at date D when its start is missing or at or before D, and its end
+is missing or after D. The queries of the current rows only filter on 'endDate > CURDATE()',
+so rows starting after today are in a current dataset but not in asOf(today).
+"""
+import numpy as np
+import pandas as pd
+
+from compactTypes import parseDates
+
+# column with the date rows are active at in the result of asOf
+AS_OF = 'asOfDate'
+
+_NAT = np.datetime64('NaT').astype(np.int64)
+_OPEN_END = np.iinfo(np.int64).max
+
+
+def toSeconds(values) -> np.ndarray:
+    """ Dates as datetime64[s], so dates like 9999-12-31 fit. Missing dates are NaT."""
+    return parseDates(pd.Series(values)).to_numpy().astype('datetime64[s]')
+
+
+def expandRanges(firsts, counts) -> np.ndarray:
+    """ firsts[i], firsts[i] + 1, .. firsts[i] + counts[i] - 1 for every i, concatenated."""
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(firsts, counts) + offsets
+
+
+def activePositions(starts, ends, dates):
+    """
+    Pairs of (row, date) for every row active at one of dates.
+
+    The dates a row is active at are a contiguous range of the sorted dates, found with
+    two binary searches per row; no row is compared with every date.
+
+    Returns
+    ------
+    rows (positions in starts and ends), positions in the sorted unique dates, the sorted unique dates
+    """
+    dates = np.unique(toSeconds(dates))
+    dates = dates[~np.isnat(dates)]
+    starts, ends = toSeconds(starts), toSeconds(ends)
+    # first date at or after the start, first date at or after the end
+    firsts = np.where(np.isnat(starts), 0, np.searchsorted(dates, starts, side='left'))
+    lasts = np.where(np.isnat(ends), len(dates), np.searchsorted(dates, ends, side='left'))
+    counts = np.maximum(lasts - firsts, 0)
+    rows = np.repeat(np.arange(len(starts)), counts)
+    return rows, expandRanges(firsts, counts), dates
+
+
+def asOf(dataframe, start, end, dates) -> pd.DataFrame:
+    """
+    Rows of dataframe active at each of dates, with the date in column asOfDate.
+    A row active at several dates is repeated, ordered by date and then by the order in dataframe.
+    """
+    rows, positions, dates = activePositions(dataframe[start], dataframe[end], dates)
+    order = np.lexsort((rows, positions))
+    result = dataframe.iloc[rows[order]].reset_index(drop=True)
+    result.insert(0, AS_OF, pd.to_datetime(dates[positions[order]]))
+    return result
+
+
+def monthStarts(first, last) -> pd.DatetimeIndex:
+    """ First day of every month from the month of first up to last."""
+    return pd.date_range(pd.Timestamp(first).to_period('M').to_timestamp(), last, freq='MS')
+
+
+def _bounds(starts, ends):
+    # periods as int64 seconds, a missing start is before and a missing end after every date
+    starts = toSeconds(starts).astype(np.int64)
+    ends = toSeconds(ends).astype(np.int64)
+    ends[ends == _NAT] = _OPEN_END
+    return starts, ends
+
+
+def overlapPositions(leftKeys, leftStarts, leftEnds, rightKeys, rightStarts, rightEnds):
+    """
+    Pairs of (left row, right row) with the same key and overlapping periods.
+    Periods include their start and exclude their end, like the active rule.
+
+    Right rows are sorted by key and start, so the candidates of a left row are the rows
+    of its key starting before its end: one binary search, and only those candidates are
+    compared with its start. No rows of other keys are ever paired.
+    """
+    return _overlapRows(leftKeys, _bounds(leftStarts, leftEnds), rightKeys, _bounds(rightStarts, rightEnds))
+
+
+def _overlapRows(leftKeys, leftBounds, rightKeys, rightBounds):
+    (leftStarts, leftEnds), (rightStarts, rightEnds) = leftBounds, rightBounds
+    codes, _ = pd.factorize(pd.concat([pd.Series(leftKeys), pd.Series(rightKeys)], ignore_index=True))
+    leftCodes, rightCodes = codes[:len(leftKeys)], codes[len(leftKeys):]
+
+    # (key, start) of right rows and (key, end) of left rows as one sortable number
+    times = np.unique(np.concatenate([rightStarts, leftEnds]))
+    width = len(times) + 1
+    rightSorted = rightCodes * width + np.searchsorted(times, rightStarts)
+    order = np.argsort(rightSorted, kind='stable')
+    rightSorted = rightSorted[order]
+    firsts = np.searchsorted(rightSorted, leftCodes * width, side='left')
+    cuts = np.searchsorted(rightSorted, leftCodes * width + np.searchsorted(times, leftEnds), side='left')
+    counts = np.where(leftCodes >= 0, np.maximum(cuts - firsts, 0), 0)
+
+    leftRows = np.repeat(np.arange(len(leftCodes)), counts)
+    rightRows = order[expandRanges(firsts, counts)]
+    overlaps = rightEnds[rightRows] > leftStarts[leftRows]
+    return leftRows[overlaps], rightRows[overlaps]
+
+
+def overlapJoin(left, right, on, left_period, right_period,
+                overlap=('startOverlapDate', 'endOverlapDate'), suffixes=('_x', '_y')) -> pd.DataFrame:
+    """
+    Inner join of left and right on column on where the periods (start, end columns) overlap.
+    Adds the overlapping part of both periods as the overlap columns, a missing end stays open.
+    """
+    leftStarts, leftEnds = _bounds(left[left_period[0]], left[left_period[1]])
+    rightStarts, rightEnds = _bounds(right[right_period[0]], right[right_period[1]])
+    leftRows, rightRows = _overlapRows(
+        left[on], (leftStarts, leftEnds), right[on], (rightStarts, rightEnds))
+    joined = left.iloc[leftRows].reset_index(drop=True)
+    others = right.drop(columns=on).iloc[rightRows].reset_index(drop=True)
+    common = joined.columns.intersection(others.columns)
+    joined = joined.rename(columns={column: column + suffixes[0] for column in common})
+    others = others.rename(columns={column: column + suffixes[1] for column in common})
+    joined = pd.concat([joined, others], axis=1)
+
+    starts = np.maximum(leftStarts[leftRows], rightStarts[rightRows])
+    ends = np.minimum(leftEnds[leftRows], rightEnds[rightRows])
+    ends[ends == _OPEN_END] = _NAT
+    joined[overlap[0]] = pd.to_datetime(starts.astype('datetime64[s]'))
+    joined[overlap[1]] = pd.to_datetime(ends.astype('datetime64[s]'))
+    return joined
@@ -0,0 +1,90 @@
+import re
+
+
+def columnName(expression: str) -> str:
+    """ Name of the column an expression like "d.updatedAt" or "validTo as endRelationDate" results in."""
+    name = re.split(r"\s+as\s+", expression.strip(), flags=re.IGNORECASE)[-1]
+    return name.split('.')[-1]
+
+
+def latestRows(rows, order, key='clientObjectId', tiebreak=None):
+    """
+    Latest row per key, ordered by order (and tiebreak for equal orders).
+    Rows without order are older than any other row.
+    """
+    columns = [key, order] + ([tiebreak] if tiebreak else [])
+    ordered = rows.sort_values(columns, na_position='first', kind='stable')
+    return ordered.drop_duplicates(key, keep='last').sort_index()
+
+
+class LatestPerKey(object):
+    """
+    Latest row per key (e.g. per client) of a table, in SQL or in pandas.
+
+    - windowQuery numbers the rows of every key with ROW_NUMBER() in the database
+      and returns the first; one pass instead of a max() subquery joined back on the timestamp.
+    - rowsQuery reads only the needed columns of all rows, pick selects the latest of them locally.
+    Both order by order, then tiebreak, so rows with the same order never both end up in the result.
+
+        latest = LatestPerKey('notifications n', key='n.clientObjectId', order='n.createdAt',
+                              columns=['n.title'], tiebreak='n.objectId')
+    """
+
+    def __init__(self, source, key, order, columns, tiebreak='objectId', where=None):
+        self.source = source
+        self.key = key
+        self.order = order
+        self.tiebreak = tiebreak
+        self.columns = list(columns)
+        self.where = where
+
+    def _select(self):
+        # key, columns, order and tiebreak, each once
+        expressions = []
+        for expression in [self.key] + self.columns + [self.order, self.tiebreak]:
+            if columnName(expression) not in map(columnName, expressions):
+                expressions.append(expression)
+        return expressions
+
+    def _conditions(self, where):
+        conditions = [condition for condition in (self.where, where) if condition]
+        if not conditions:
+            return ""
+        return "\n    where " + "\n    and ".join(f"({condition})" for condition in conditions)
+
+    @property
+    def names(self) -> list:
+        """ Columns of the result: key and columns."""
+        return [columnName(expression) for expression in [self.key] + self.columns]
+
+    def windowQuery(self, where=None) -> str:
+        """ Latest rows selected in the database, where adds a condition to the rows considered."""
+        select = ',\n        '.join(self._select())
+        return f"""
+    select {', '.join(self.names)}
+    from (
+        select
+        {select},
+        row_number() over (
+            partition by {self.key}
+            order by {self.order} desc, {self.tiebreak} desc
+        ) as latestRank
+        from {self.source}{self._conditions(where)}
+    ) as ranked
+    where latestRank = 1
+    """
+
+    def rowsQuery(self, where=None) -> str:
+        """ All rows with the columns needed to pick the latest ones."""
+        select = ',\n        '.join(self._select())
+        return f"""
+    select
+        {select}
+    from {self.source}{self._conditions(where)}
+    """
+
+    def pick(self, rows):
+        """ Latest row per key of rows read with rowsQuery, with the columns of the result."""
+        latest = latestRows(rows, columnName(self.order), key=columnName(self.key),
+                            tiebreak=columnName(self.tiebreak))
+        return latest[self.names]
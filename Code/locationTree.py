@@ -0,0 +1,179 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Groups of locations by objectId, selected with LocationTree.tagged
+TAGS = {
+    'extramural': [
+        270,  # Renbaankwartier
+        98,   # Belgisch Park
+        271,  # Benoordenhout
+        272,  # Scheveningen Dorp
+        273   # Duindorp
+    ],
+    # 8 = Bosch en Duin: 186, 236, 213, 237, 163, 239, 230, 238
+    # 12 = Quintus: 48, 71, 111, 125
+    # 75 = het Uiterjoon: 138
+    # 489 = Zeewinde: 490, 507, 524, 533
+    'psychogeriatric': [
+        490,  # ZW Boswinde
+        507,  # ZW Parkdael
+        524,  # ZW Duinwinde
+        533,  # ZW Parkzicht
+        138,  # HU Het Anker
+        48,   # QS Aanlegsteiger
+        71,   # QS Loggerthe
+        111,  # QS Nooder Den
+        125,  # QS Zuider Den
+        186,  # BD Duinrier
+        236,  # BD Zeeanemoon
+        213,  # BD Duinroos
+        237,  # BD Zeeappel
+        163,  # BD Duindoorn
+        239,  # BD Zeekraal
+        230,  # BD Duinviool
+        238   # BD Zee-egel
+    ]
+}
+
+
+class LocationTree(object):
+    """
+    Hierarchy of the locations table (location > afdeling > kamer), built once.
+
+    - parents, depths and the Euler tour (enter, exit) are arrays by position,
+      a location is in the subtree of another when its enter falls in the other's [enter, exit).
+    - Lookups like parentOf and ancestorOfType take many ids at once.
+    - Groups of locations are selected by name (matching) or tag (tagged), with their subtrees.
+    """
+
+    def __init__(self, locations, id='objectId', parent='parentObjectId', name='name', type='type'):
+        self.ids = locations[id].to_numpy(dtype=np.int64)
+        self._index = pd.Index(self.ids)
+        self.names = locations[name].to_numpy(dtype=object)
+        self._nameType = locations[name].dtype
+        self.types = locations[type].to_numpy()
+        # position of the parent, -1 for roots and parents that aren't in the table
+        self.parents = self._index.get_indexer(pd.to_numeric(locations[parent]))
+        self.tags = {tag: list(ids) for tag, ids in TAGS.items()}
+        self._tour()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self._index
+
+    def _tour(self):
+        # children of every position, in the order of the table
+        order = np.argsort(self.parents, kind='stable')
+        counts = np.bincount(self.parents + 1, minlength=len(self.ids) + 1)
+        firsts = np.concatenate([[0], np.cumsum(counts)])
+        self.enter = np.full(len(self.ids), -1)
+        self.exit = np.full(len(self.ids), -1)
+        self.depths = np.zeros(len(self.ids), dtype=np.int64)
+        tick = 0
+        roots = order[firsts[0]:firsts[1]]
+        stack = [(root, False) for root in roots[::-1]]
+        while stack:
+            position, leaving = stack.pop()
+            if leaving:
+                self.exit[position] = tick
+                continue
+            if self.enter[position] >= 0:
+                continue
+            self.enter[position] = tick
+            tick += 1
+            stack.append((position, True))
+            children = order[firsts[position + 1]:firsts[position + 2]]
+            self.depths[children] = self.depths[position] + 1
+            stack.extend((child, False) for child in children[::-1])
+        # locations in a parent cycle are never reached from a root, they form no subtree
+        unreached = self.enter < 0
+        self.enter[unreached] = self.exit[unreached] = tick
+
+    def positions(self, ids) -> np.ndarray:
+        """ Positions of ids in the tree, -1 for unknown or missing ids."""
+        return self._index.get_indexer(pd.to_numeric(pd.Series(ids)).to_numpy())
+
+    def _result(self, positions, values, like):
+        # values by position as series aligned with like, missing for unknown positions
+        index = like.index if isinstance(like, pd.Series) else None
+        found = positions >= 0
+        picked = values[np.maximum(positions, 0)] if len(values) else np.zeros(len(positions), dtype=values.dtype)
+        if values.dtype.kind in 'iu':
+            return pd.Series(pd.arrays.IntegerArray(picked.astype(np.int64), ~found), index=index)
+        return pd.Series(np.where(found, picked, None), index=index, dtype=object)
+
+    def parentOf(self, ids) -> pd.Series:
+        """ Parent id of each of ids, missing for roots and unknown ids."""
+        positions = self.positions(ids)
+        parents = np.where(positions >= 0, self.parents[positions], -1)
+        return self._result(parents, self.ids, ids)
+
+    def nameOf(self, ids) -> pd.Series:
+        return self._result(self.positions(ids), self.names, ids).astype(self._nameType)
+
+    def ancestorOfType(self, ids, type) -> pd.Series:
+        """ First of each of ids and its ancestors with type, e.g. the afdeling of a kamer or of an afdeling."""
+        current = self.positions(ids)
+        found = np.full(len(current), -1)
+        for _ in range(self.depths.max(initial=0) + 1):
+            match = (current >= 0) & (found < 0)
+            match[match] = self.types[current[match]] == type
+            found[match] = current[match]
+            current = np.where(current >= 0, self.parents[np.maximum(current, 0)], -1)
+        return self._result(found, self.ids, ids)
+
+    def isAncestor(self, ancestor, ids) -> np.ndarray:
+        """ Whether ancestor is each of ids or one of their ancestors."""
+        root = self.positions([ancestor])[0]
+        positions = self.positions(ids)
+        if root < 0:
+            return np.zeros(len(positions), dtype=bool)
+        entered = self.enter[np.maximum(positions, 0)]
+        return (positions >= 0) & (self.enter[root] <= entered) & (entered < self.exit[root])
+
+    def inSubtrees(self, ids, roots) -> np.ndarray:
+        """ Whether each of ids is one of roots or below one of them."""
+        roots = self.positions(roots)
+        roots = roots[roots >= 0]
+        # number of subtrees every position of the Euler tour is in
+        cover = np.zeros(len(self.ids) + 2, dtype=np.int64)
+        np.add.at(cover, self.enter[roots], 1)
+        np.add.at(cover, self.exit[roots], -1)
+        covered = np.cumsum(cover) > 0
+        positions = self.positions(ids)
+        return (positions >= 0) & covered[self.enter[np.maximum(positions, 0)]]
+
+    def subtree(self, roots, maxDepth=None) -> np.ndarray:
+        """ Sorted ids of roots and the locations below them, at most maxDepth levels below."""
+        if maxDepth is None:
+            return np.sort(self.ids[self.inSubtrees(self.ids, roots)])
+        selected = self.positions(roots)
+        selected = np.unique(selected[selected >= 0])
+        level = selected
+        for _ in range(maxDepth):
+            level = np.flatnonzero(np.isin(self.parents, level))
+            selected = np.union1d(selected, level)
+        return np.sort(self.ids[selected])
+
+    def matching(self, pattern) -> np.ndarray:
+        """ Ids of locations with a name matching regular expression pattern, ignoring case."""
+        expression = re.compile(pattern, re.IGNORECASE)
+        return self.ids[[bool(expression.search(str(name))) for name in self.names]]
+
+    def tag(self, tag, ids):
+        """ Adds ids to the locations of tag."""
+        self.tags.setdefault(tag, []).extend(ids)
+
+    def tagged(self, tag, maxDepth=0) -> np.ndarray:
+        """ Ids of locations with tag in the tree, with the locations up to maxDepth levels below them."""
+        return self.subtree(self.tags[tag], maxDepth=maxDepth)
+
+    def frame(self, ids, id='locationId', name='locatieNaam') -> pd.DataFrame:
+        """ Dataframe with the id and name of ids."""
+        ids = np.asarray(ids, dtype=np.int64)
+        names = pd.Series(self.names[self.positions(ids)], dtype=self._nameType)
+        return pd.DataFrame({id: ids, name: names})
@@ -0,0 +1,130 @@
+"""
+Keyed pseudonyms for columns with personal data, like the BSN, names and contact details of clients.
+
+    pseudonymization.enablePseudonyms()                # key from ONS_PSEUDONYM_KEY
+    clients = IntramuralClients()
+    clients.addAllClientInfo()
+    clients.pseudonymize()
+
+The pseudonym of a value is the keyed BLAKE2b hash (a MAC, like HMAC) of the column name and the value,
+so the same value in the same column gets the same pseudonym in every run, but can't be
+recovered without the key. Columns are pseudonymized per distinct value: every value is
+hashed once, then the pseudonyms are gathered for all rows.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# environment variable with the secret key, see enablePseudonyms
+KEY_VARIABLE = 'ONS_PSEUDONYM_KEY'
+
+# Opt-in pseudonymizer used by ClientObjectTable.pseudonymize, see enablePseudonyms
+pseudonymizer = None
+
+
+def enablePseudonyms(key=None, length=16, max_workers=None):
+    """
+    Lets datasets pseudonymize their personal data with key, see Pseudonymizer.
+
+    Parameters
+    ------
+    key (type: string) : secret key, ONS_PSEUDONYM_KEY by default
+    length (type: int) : number of hexadecimal characters of a pseudonym
+    max_workers (type: int) : processes hashing large columns, None hashes in this process
+    """
+    global pseudonymizer
+    pseudonymizer = Pseudonymizer(key, length=length, max_workers=max_workers)
+    return pseudonymizer
+
+
+def disablePseudonyms():
+    global pseudonymizer
+    pseudonymizer = None
+
+
+def hashValues(key: bytes, domain: str, values, length=16) -> list:
+    """ Pseudonyms of values (strings) in domain, e.g. a column name."""
+    if len(key) > hashlib.blake2b.MAX_KEY_SIZE:
+        key = hashlib.blake2b(key).digest()
+    # the state after the key and domain is copied for every value instead of hashing them again
+    start = hashlib.blake2b(domain.encode() + b'\0', key=key, digest_size=(length + 1) // 2)
+    pseudonyms = []
+    for value in values:
+        hashed = start.copy()
+        hashed.update(value.encode())
+        pseudonyms.append(hashed.hexdigest()[:length])
+    return pseudonyms
+
+
+def _texts(values) -> list:
+    # distinct values as text, integral floats (like a BSN read as float) without decimals
+    values = pd.Series(values)
+    if values.dtype.kind == 'f' and (values % 1 == 0).all():
+        values = values.astype('int64')
+    return [str(value).strip() for value in values.tolist()]
+
+
+class Pseudonymizer(object):
+    """
+    Pseudonymizes columns with a secret key.
+
+    - Pseudonyms of values seen before come from an in-memory mapping per column, so datasets
+      sharing columns (like clientBsn) and repeated exports hash every value only once.
+      The mapping is never written to disk, it would link the personal data to the pseudonyms.
+    - Values not seen before are hashed on max_workers processes when there are more than parallel_from.
+    """
+
+    def __init__(self, key=None, length=16, max_workers=None, parallel_from=200000):
+        key = key if key is not None else os.environ.get(KEY_VARIABLE)
+        if not key:
+            raise ValueError(f"A key is needed for pseudonyms, pass one or set {KEY_VARIABLE}")
+        self._key = key.encode() if isinstance(key, str) else bytes(key)
+        self.length = length
+        self.max_workers = max_workers
+        self.parallel_from = parallel_from
+        # {domain: {value: pseudonym}}
+        self._mapping = {}
+        self._lock = threading.Lock()
+
+    def pseudonyms(self, values, domain) -> np.ndarray:
+        """ Pseudonyms of distinct values in domain."""
+        texts = _texts(values)
+        with self._lock:
+            known = self._mapping.setdefault(domain, {})
+        result = np.array([known.get(text) for text in texts], dtype=object)
+        missing = np.flatnonzero(np.equal(result, None))
+        if len(missing):
+            new = [texts[position] for position in missing]
+            result[missing] = self._hash(new, domain)
+            with self._lock:
+                known.update(zip(new, result[missing]))
+        return result
+
+    def _hash(self, texts, domain) -> list:
+        if not self.max_workers or self.max_workers < 2 or len(texts) < self.parallel_from:
+            return hashValues(self._key, domain, texts, self.length)
+        size = -(-len(texts) // self.max_workers)
+        chunks = [texts[start:start + size] for start in range(0, len(texts), size)]
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            hashed = pool.map(hashValues, [self._key] * len(chunks), [domain] * len(chunks),
+                              chunks, [self.length] * len(chunks))
+            return [pseudonym for chunk in hashed for pseudonym in chunk]
+
+    def pseudonymize(self, series, domain=None) -> pd.Series:
+        """ series with every value replaced by its pseudonym, missing values stay missing."""
+        codes, uniques = pd.factorize(series)
+        pseudonyms = self.pseudonyms(uniques, series.name if domain is None else domain)
+        result = np.full(len(codes), None, dtype=object)
+        result[codes >= 0] = pseudonyms[codes[codes >= 0]]
+        return pd.Series(result, index=series.index, name=series.name)
+
+    def pseudonymizeFrame(self, dataframe, columns) -> pd.DataFrame:
+        """ Copy of dataframe with columns (those present) pseudonymized, each in the domain of its name."""
+        return dataframe.assign(**{
+            column: self.pseudonymize(dataframe[column])
+            for column in columns if column in dataframe.columns
+        })
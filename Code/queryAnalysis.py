@@ -0,0 +1,328 @@
+"""
+Query plans and slow queries of datasets, with suggested indexes and rewrites.
+
+    queryTable.enableAnalysis('Output/analysis', slow_after=1.0)
+    IntramuralClients()
+    queryTable.analyzer.report()
+
+    python queryAnalysis.py Output/analysis       # builds all datasets and prints the report
+
+Every distinct query is explained once (EXPLAIN on MySQL, EXPLAIN QUERY PLAN on a sqlite stand-in)
+when the report is made, and its plan is checked for full table scans, sorts without an index
+(filesort) and temporary tables. Queries slower than slow_after seconds are appended to a local history.
+"""
+import argparse
+import datetime
+import json
+import pathlib
+import re
+import threading
+import warnings
+
+import pandas as pd
+
+from queryCache import normalizeQuery, queryKey
+from queryTable import dialectName, portableQuery
+
+_PLANS = 'plans.json'
+_HISTORY = 'history.jsonl'
+
+_TABLE = re.compile(r"\b(?:from|join)\s+([a-z_]\w*)(?:\s+(?:as\s+)?(?!on\b|where\b|join\b|left\b|right\b|inner\b|group\b|order\b)([a-z_]\w*))?",
+                    re.IGNORECASE)
+_SUBQUERY = re.compile(r"\(\s*select\b", re.IGNORECASE)
+_DERIVED = re.compile(r"\)\s*(?:as\s+)?([a-z_]\w*)", re.IGNORECASE)
+_OPERATOR = r"\s*(?:=|<|>|!=|\bin\b|\blike\b|\bis\b|\bbetween\b)"
+_KEYWORDS = {'and', 'or', 'not', 'null', 'where', 'on', 'when', 'then', 'else', 'select', 'having'}
+
+
+def explain(query: str, conn_engine) -> pd.DataFrame:
+    """
+    Plan of query, a row per step with the table, the access, and whether it is a full scan,
+    a filesort or uses a temporary table.
+    """
+    dialect = dialectName(conn_engine)
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    query = portableQuery(query, conn_engine)
+    if hasattr(conn_engine, 'exec_driver_sql'):
+        result = conn_engine.exec_driver_sql(prefix + query)
+        rows = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    else:
+        with conn_engine.connect() as connection:
+            result = connection.exec_driver_sql(prefix + query)
+            rows = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    if dialect == 'sqlite':
+        return _sqlitePlan(rows)
+    if dialect in ('mysql', 'mariadb'):
+        return _mysqlPlan(rows)
+    return _textPlan(rows)
+
+
+def _mysqlPlan(rows):
+    extra = rows['Extra'].fillna('').astype(str)
+    return pd.DataFrame({
+        'table': rows['table'].astype(object),
+        'access': rows['type'].astype(object),
+        'full_scan': (rows['type'] == 'ALL').to_numpy(),
+        'filesort': extra.str.contains('filesort').to_numpy(),
+        'temporary': extra.str.contains('temporary').to_numpy(),
+        'detail': (rows['key'].fillna('no index').astype(str) + ', ' + extra).to_numpy()
+    })
+
+
+def _sqlitePlan(rows):
+    detail = rows['detail'].astype(str)
+    scans = detail.str.extract(r'^SCAN (?:TABLE )?(\w+)')[0]
+    return pd.DataFrame({
+        'table': scans.fillna(detail.str.extract(r'^SEARCH (?:TABLE )?(\w+)')[0]).astype(object),
+        'access': detail.str.split().str[0].astype(object),
+        'full_scan': (scans.notna() & ~detail.str.contains('INDEX')).to_numpy(),
+        'filesort': detail.str.contains('FOR ORDER BY').to_numpy(),
+        'temporary': detail.str.contains('FOR GROUP BY|FOR DISTINCT|MATERIALIZE|CO-ROUTINE').to_numpy(),
+        'detail': detail.to_numpy()
+    })
+
+
+def _textPlan(rows):
+    # plans of other databases as lines of text, like postgres
+    detail = rows.iloc[:, 0].astype(str)
+    return pd.DataFrame({
+        'table': detail.str.extract(r'Scan on (\w+)')[0].astype(object),
+        'access': detail.str.strip().str.split().str[0].astype(object),
+        'full_scan': detail.str.contains('Seq Scan').to_numpy(),
+        'filesort': detail.str.contains(r'\bSort\b').to_numpy(),
+        'temporary': detail.str.contains('Materialize|HashAggregate').to_numpy(),
+        'detail': detail.to_numpy()
+    })
+
+
+def aliases(query: str) -> dict:
+    """ {alias: table} of the tables in the from and join clauses of query, tables are their own alias."""
+    found = {}
+    for table, alias in _TABLE.findall(query):
+        if table.lower() == 'select':
+            continue
+        found[table] = table
+        if alias:
+            found[alias] = table
+    return found
+
+
+def conditionColumns(query: str, alias: str, unqualified=False) -> list:
+    """
+    Columns of alias compared in query, candidates for an index.
+    With unqualified=True also the columns compared without an alias, for queries on a single table.
+    """
+    name = re.escape(alias)
+    columns = re.findall(rf"\b{name}\.(\w+){_OPERATOR}", query, re.IGNORECASE)
+    columns += re.findall(rf"(?:=|<|>)\s*{name}\.(\w+)", query, re.IGNORECASE)
+    if unqualified:
+        # names given with 'as' are columns of the result, not of the table
+        renamed = {name.lower() for name in re.findall(r"\bas\s+(\w+)", query, re.IGNORECASE)}
+        columns += [column for column in re.findall(rf"(?<![\w.'])([a-z_]\w*){_OPERATOR}", query, re.IGNORECASE)
+                    if column.lower() not in _KEYWORDS | renamed]
+    return list(dict.fromkeys(columns))
+
+
+def _subqueries(query: str) -> list:
+    # text of every (select ...) in query
+    found = []
+    for match in _SUBQUERY.finditer(query):
+        depth = 0
+        for end in range(match.start(), len(query)):
+            depth += {'(': 1, ')': -1}.get(query[end], 0)
+            if depth == 0:
+                found.append(normalizeQuery(query[match.start() + 1:end]))
+                break
+    return found
+
+
+def queryHints(query: str) -> list:
+    """ Rewrites suggested by the text of query alone."""
+    hints = []
+    if re.search(r"\bright\s+join\b", query, re.IGNORECASE):
+        hints.append("right join: join the tables directly from the side with the rows you need, "
+                     "joined subqueries are materialized without indexes")
+    subqueries = _subqueries(query)
+    repeated = {subquery for subquery in subqueries if subqueries.count(subquery) > 1}
+    for subquery in repeated:
+        hints.append(f"the same subquery runs {subqueries.count(subquery)} times, compute it once: {subquery[:80]}")
+    if re.search(r"\(\s*select\s[^()]*\bmax\s*\(", query, re.IGNORECASE):
+        hints.append("latest row per group with a max() subquery joined back on the timestamp, "
+                     "use latestPerKey.LatestPerKey")
+    for column in re.findall(r"([\w.]+)\s+like\s+'%", query, re.IGNORECASE):
+        hints.append(f"like '%..' on {column} can't use an index, use a local index (documentIndex) or a code table")
+    return list(dict.fromkeys(hints))
+
+
+def suggestions(query: str, plan) -> list:
+    """ Indexes and rewrites suggested by the plan of query and its text."""
+    found = []
+    tables = aliases(query)
+    # unqualified columns can only be resolved when a single table is in scope
+    single = len(set(tables.values())) == 1
+    # scans of subqueries in the from clause are covered by their temporary table,
+    # like the <derived2> and <subquery3> rows of MySQL plans
+    derived = set(_DERIVED.findall(query))
+    for alias in plan.loc[plan['full_scan'], 'table'].dropna().astype(str).unique():
+        if alias.startswith('<') or (alias in derived and alias not in tables):
+            continue
+        table = tables.get(alias, alias)
+        columns = conditionColumns(query, alias, unqualified=single) \
+            or (conditionColumns(query, table) if table != alias else [])
+        if columns:
+            found.append(f"full scan of {table}: index {table} ({', '.join(columns)})")
+        elif re.search(r"\bwhere\b", query, re.IGNORECASE):
+            found.append(f"full scan of {table}: check that its conditions can use an index, or select fewer rows")
+        else:
+            found.append(f"full scan of {table} without conditions on it: filter it or select fewer rows")
+    if plan['filesort'].any():
+        found.append("sort without an index: index the order by / group by columns, or sort in pandas")
+    if plan['temporary'].any():
+        found.append("temporary table for group by, distinct or a subquery: "
+                     "group on indexed columns, or pick rows in pandas (derive_locally)")
+    return found + queryHints(query)
+
+
+class QueryAnalyzer(object):
+    """
+    Explains every distinct query of the datasets once and keeps the queries slower than slow_after.
+
+    - record only counts a run, new queries are explained by explainPending (called by report)
+      on their database, so building the datasets doesn't wait for EXPLAIN.
+    - plans.json in directory has the query and plan per dataset and query.
+    - history.jsonl gets a line for every slow run: time, dataset, query key, seconds and rows.
+    - report combines them with the runs of this session into suggestions per query.
+    """
+
+    def __init__(self, directory, slow_after=1.0):
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.slow_after = slow_after
+        self._lock = threading.Lock()
+        # {key: {'dataset', 'query', 'plan'}}
+        self.plans = self._readPlans()
+        # {key: {'calls', 'seconds', 'max_seconds'}} of this session
+        self.runs = {}
+        # {key: (dataset, query, engine)} of the queries not explained yet
+        self._pending = {}
+
+    @staticmethod
+    def key(dataset, query) -> str:
+        return f"{dataset}:{queryKey(query)[:12]}"
+
+    def record(self, dataset, query, conn_engine, seconds, rows):
+        """ Records a run of query (as the dataset wrote it) by dataset on conn_engine."""
+        key = self.key(dataset, query)
+        with self._lock:
+            run = self.runs.setdefault(key, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            run['calls'] += 1
+            run['seconds'] += seconds
+            run['max_seconds'] = max(run['max_seconds'], seconds)
+            if key not in self.plans and key not in self._pending:
+                # the engine, connections of the datasets may be closed when the query is explained
+                self._pending[key] = (dataset, query, getattr(conn_engine, 'engine', conn_engine))
+        if seconds >= self.slow_after:
+            line = json.dumps({
+                'time': datetime.datetime.now().isoformat(), 'dataset': dataset,
+                'key': key, 'seconds': seconds, 'rows': rows
+            })
+            with self._lock:
+                with open(self.directory / _HISTORY, 'a') as file:
+                    file.write(line + '\n')
+
+    def explainPending(self):
+        """ Explains the queries recorded since the last call and stores their plans."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        explained = {}
+        for key, (dataset, query, engine) in pending.items():
+            try:
+                plan = explain(query, engine).to_dict('records')
+            except Exception as e:
+                warnings.warn(f"Could not explain the query of {dataset}: {e}")
+                plan = []
+            explained[key] = {'dataset': dataset, 'query': normalizeQuery(query), 'plan': plan}
+        with self._lock:
+            self.plans.update(explained)
+            self._writePlans()
+
+    def history(self) -> pd.DataFrame:
+        """ All slow runs recorded in directory."""
+        try:
+            return pd.read_json(self.directory / _HISTORY, lines=True)
+        except (OSError, ValueError):
+            return pd.DataFrame(columns=['time', 'dataset', 'key', 'seconds', 'rows'])
+
+    def plan(self, key) -> pd.DataFrame:
+        with self._lock:
+            plan = self.plans[key]['plan']
+        return pd.DataFrame(plan, columns=['table', 'access', 'full_scan', 'filesort', 'temporary', 'detail'])
+
+    def report(self) -> pd.DataFrame:
+        """
+        A row per dataset and query: runs of this session, slow runs in the history,
+        the full scans, filesorts and temporary tables of its plan and the suggestions.
+        """
+        self.explainPending()
+        with self._lock:
+            plans = dict(self.plans)
+            runs = {key: dict(run) for key, run in self.runs.items()}
+        history = self.history()
+        slow = history.groupby('key')['seconds'].agg(['count', 'max']) if len(history) else pd.DataFrame(columns=['count', 'max'])
+        rows = []
+        for key, explained in plans.items():
+            plan = pd.DataFrame(explained['plan'], columns=['table', 'access', 'full_scan', 'filesort', 'temporary', 'detail'])
+            run = runs.get(key, {})
+            rows.append({
+                'dataset': explained['dataset'],
+                'calls': run.get('calls', 0),
+                'seconds': run.get('seconds', 0.0),
+                'slow_runs': int(slow['count'].get(key, 0)),
+                'slowest': slow['max'].get(key),
+                'full_scans': ', '.join(plan.loc[plan['full_scan'], 'table'].dropna().astype(str).unique()),
+                'filesort': bool(plan['filesort'].any()),
+                'temporary': bool(plan['temporary'].any()),
+                'suggestions': suggestions(explained['query'], plan),
+                'key': key
+            })
+        report = pd.DataFrame(rows)
+        if report.empty:
+            return report
+        return report.sort_values(['slow_runs', 'seconds'], ascending=False).reset_index(drop=True)
+
+    def _readPlans(self):
+        try:
+            with open(self.directory / _PLANS) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _writePlans(self):
+        tmp = self.directory / (_PLANS + '.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(self.plans, file, indent=2, default=str)
+        tmp.replace(self.directory / _PLANS)
+
+
+if __name__ == "__main__":
+    import configuration as config
+    import queryTable
+    from datasetLoader import DATASETS, datasetClass, loadDatasets
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--datasets', nargs='*', default=DATASETS)
+    parser.add_argument('--slow-after', type=float, default=1.0)
+    parser.add_argument('--database', help='local stand-in database to analyse instead of ONS')
+    arguments = parser.parse_args()
+
+    if arguments.database:
+        import syntheticData
+        config.useEngine(syntheticData.standInEngine(arguments.database))
+    analyzer = queryTable.enableAnalysis(arguments.directory, slow_after=arguments.slow_after)
+    loadDatasets([datasetClass(dataset) for dataset in arguments.datasets])
+    for row in analyzer.report().itertuples():
+        print(f"\n{row.dataset}: {row.calls} runs, {row.seconds:.2f}s, {row.slow_runs} slow runs recorded")
+        for suggestion in row.suggestions:
+            print(f"  - {suggestion}")
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import pathlib
+import re
+import threading
+import time
+import warnings
+
+import pandas as pd
+
+
+# string literals and quoted names, MySQL style: quotes are escaped by doubling them or with a backslash
+LITERALS = r"""'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`"""
+# a literal, or a run of whitespace and comments outside of literals
+_TOKEN = re.compile(rf"""({LITERALS})|(?:\s|#[^\n]*|--[^\n]*|/\*.*?\*/)+""", re.S)
+
+
+def normalizeQuery(query: str) -> str:
+    """
+    Strips comments and collapses whitespace so that formatting changes
+    to a query don't produce a different cache key. String literals are kept as they are.
+    """
+    return _TOKEN.sub(lambda match: match.group(1) or ' ', str(query)).strip()
+
+
+def connectionIdentity(conn_engine) -> str:
+    """ Returns the url of a connection or engine without its password."""
+    if conn_engine is None:
+        return ""
+    url = getattr(getattr(conn_engine, 'engine', conn_engine), 'url', None)
+    if url is None:
+        return repr(conn_engine)
+    if hasattr(url, 'render_as_string'):
+        return url.render_as_string(hide_password=True)
+    return repr(url)
+
+
+def queryKey(query, conn_engine=None) -> str:
+    """
+    Key of query on a connection, shared by the result cache, the session registry, the snapshots
+    and the query analysis: queries differing only in comments and whitespace get the same key,
+    queries differing in a string literal don't.
+    """
+    text = connectionIdentity(conn_engine) + '\n' + normalizeQuery(query)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class QueryCache(object):
+    """
+    On-disk result cache for QueryTable.
+
+    - Results are stored as parquet files, one per query and connection.
+    - Entries older than their time to live (seconds) are reloaded.
+    - When the cache exceeds max_bytes the least recently used entries are removed.
+    """
+    _INDEX = 'index.json'
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, default_ttl=60 * 60):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index = self._readIndex()
+        self._lock = threading.RLock()
+
+    def key(self, query, conn_engine=None) -> str:
+        """ Cache key of a query on a connection."""
+        return queryKey(query, conn_engine)
+
+    def get(self, key, ttl=None):
+        """ Returns the cached dataframe, or None when it is missing or expired."""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            ttl = self.default_ttl if ttl is None else ttl
+            path = self.directory / entry['file']
+            if (ttl is not None and time.time() - entry['created'] > ttl) or not path.exists():
+                self._remove(key)
+                self._writeIndex()
+                return None
+            entry['accessed'] = time.time()
+            self._writeIndex()
+        try:
+            return pd.read_parquet(path)
+        except FileNotFoundError:
+            # evicted by another thread in the meantime
+            return None
+
+    def put(self, key, dataframe, dataset=None):
+        """ Stores a dataframe under key, then evicts entries beyond max_bytes."""
+        path = self.directory / f"{key}.parquet"
+        tmp = path.with_suffix('.tmp')
+        try:
+            dataframe.to_parquet(tmp, index=False)
+        except Exception as e:
+            # e.g. mixed-type object columns, the result is still returned uncached
+            warnings.warn(f"Could not cache result of {dataset}: {e}")
+            if tmp.exists():
+                tmp.unlink()
+            return
+        with self._lock:
+            os.replace(tmp, path)
+            now = time.time()
+            self._index[key] = {
+                'file': path.name,
+                'dataset': dataset,
+                'size': path.stat().st_size,
+                'created': now,
+                'accessed': now
+            }
+            self._evict()
+            self._writeIndex()
+
+    def invalidate(self, dataset=None, query=None, conn_engine=None):
+        """
+        Removes cached results.
+
+        Parameters
+        ------
+        dataset (type: string or class) : remove all results loaded by this dataset class
+        query (type: string) : remove the result of this query on conn_engine
+        Without arguments the whole cache is removed.
+        Returns
+        ------
+        number of removed entries
+        """
+        with self._lock:
+            if query is not None:
+                keys = [self.key(query, conn_engine)]
+            elif dataset is not None:
+                name = getattr(dataset, '__name__', dataset)
+                keys = [k for k, e in self._index.items() if e['dataset'] == name]
+            else:
+                keys = list(self._index)
+            removed = sum(self._remove(k) for k in keys)
+            self._writeIndex()
+            return removed
+
+    @property
+    def size(self) -> int:
+        """ Total size of the cached files in bytes."""
+        return sum(e['size'] for e in self._index.values())
+
+    def _evict(self):
+        lru = sorted(self._index, key=lambda k: self._index[k]['accessed'])
+        while lru and self.size > self.max_bytes:
+            self._remove(lru.pop(0))
+
+    def _remove(self, key) -> bool:
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return False
+        path = self.directory / entry['file']
+        if path.exists():
+            path.unlink()
+        return True
+
+    def _readIndex(self):
+        try:
+            with open(self.directory / self._INDEX) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _writeIndex(self):
+        tmp = self.directory / (self._INDEX + '.tmp')
+        with open(tmp, 'w') as file:
+            json.dump(self._index, file)
+        os.replace(tmp, self.directory / self._INDEX)
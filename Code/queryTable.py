@@ -1,17 +1,655 @@
+import arrowFetch
 import configuration as config
+import contextlib
+import instrumentation
+import intervals
+import numbers
+import numpy as np
 import pandas as pd
-from configuration import conn_engine
+import re
+import threading
+import time
+import warnings
+from compactTypes import compactFrame
+from incrementalRefresh import SnapshotStore
+from queryCache import LITERALS, QueryCache, connectionIdentity, normalizeQuery, queryKey
+
+# Opt-in result cache, see enableCache
+cache = None
+# Opt-in store for incremental refreshes, see enableIncremental
+snapshots = None
+# Registry of the running session, see session
+registry = None
+# dtype backend of results read with the Arrow fetch path, None when disabled, see enableArrow
+arrow = None
+# Opt-in capture of query plans and slow queries, see enableAnalysis
+analyzer = None
+
+
+def enableCache(directory, max_bytes=2 * 1024 ** 3, default_ttl=60 * 60):
+    """
+    Stores query results on disk so that reloading a dataset doesn't hit the database.
+
+    Parameters
+    ------
+    directory (type: string) : folder to store the cached results in
+    max_bytes (type: int) : size after which least recently used results are removed
+    default_ttl (type: int) : seconds a result stays valid when a dataset sets no cache_ttl
+    """
+    global cache
+    cache = QueryCache(directory, max_bytes=max_bytes, default_ttl=default_ttl)
+    return cache
+
+
+def disableCache():
+    global cache
+    cache = None
+
+
+def enableIncremental(directory, full_refresh_after=7 * 24 * 60 * 60):
+    """
+    Keeps the source rows of datasets with a delta_query on disk, so that loading
+    them again only reads the rows changed since the previous load.
+
+    Parameters
+    ------
+    directory (type: string) : folder to store the rows in
+    full_refresh_after (type: int) : seconds after which all rows are read again
+    """
+    global snapshots
+    snapshots = SnapshotStore(directory, full_refresh_after=full_refresh_after)
+    return snapshots
+
+
+def disableIncremental():
+    global snapshots
+    snapshots = None
+
+
+def enableAnalysis(directory, slow_after=1.0):
+    """
+    Explains every distinct query of the datasets and records the slow ones, see queryAnalysis.
+
+    Parameters
+    ------
+    directory (type: string) : folder to store the plans and the slow query history in
+    slow_after (type: float) : seconds after which a query is recorded as slow
+    """
+    global analyzer
+    from queryAnalysis import QueryAnalyzer
+    analyzer = QueryAnalyzer(directory, slow_after=slow_after)
+    return analyzer
+
+
+def disableAnalysis():
+    global analyzer
+    analyzer = None
+
+
+def enableArrow(dtype_backend='numpy'):
+    """
+    Reads query results into Arrow with connectorx instead of row by row through sqlalchemy.
+    Falls back to the regular path when connectorx isn't installed or can't read the database.
+
+    Parameters
+    ------
+    dtype_backend (type: string) : 'numpy' for the usual dtypes, 'pyarrow' to keep the Arrow memory (pd.ArrowDtype)
+    """
+    global arrow
+    if dtype_backend not in ('numpy', 'pyarrow'):
+        raise ValueError(f"dtype_backend should be 'numpy' or 'pyarrow', not {dtype_backend!r}")
+    arrow = dtype_backend
+    return arrowFetch.available()
+
+
+def disableArrow():
+    global arrow
+    arrow = None
+
+
+class DatasetRegistry(object):
+    """
+    Keeps one loaded dataframe per query so that datasets built from the same
+    source table within a session share a single database round trip.
+    Consumers get a copy, changes to it don't affect other datasets.
+    Objects built from query results, like the location tree, are shared with shared.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query, conn_engine, load):
+        """ Returns the result of query, calling load() only the first time."""
+        return self._once(queryKey(query, conn_engine), load).copy()
+
+    def shared(self, name, conn_engine, build):
+        """ Returns the object called name of conn_engine, calling build() only the first time. Not copied."""
+        return self._once((connectionIdentity(conn_engine), name), build)
+
+    def _once(self, key, load):
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        # threads asking for the same key wait for the first one to load it
+        with lock:
+            if key in self._results:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._results[key] = load()
+            return self._results[key]
+
+    def clear(self):
+        self._results = {}
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._results)
+
+
+def startSession():
+    """ Starts sharing query results between datasets until endSession is called."""
+    global registry
+    if registry is None:
+        registry = DatasetRegistry()
+    return registry
+
+
+def endSession():
+    """ Releases all results shared in the running session."""
+    global registry
+    if registry is not None:
+        registry.clear()
+    registry = None
+
+
+@contextlib.contextmanager
+def session():
+    """
+    Shares query results between all datasets built within the with-block:
+
+        with queryTable.session():
+            intramural = IntramuralClients()
+            extramural = ExtramuralClients()
+
+    Nested sessions reuse the outer session.
+    """
+    if registry is not None:
+        yield registry
+        return
+    try:
+        yield startSession()
+    finally:
+        endSession()
+
+
+# string literals, quoted identifiers and comments, in which a '#' doesn't start a comment
+_QUOTED = re.compile(rf"""({LITERALS}|--[^\n]*|/\*.*?\*/)|#""", re.S)
+
+
+def dialectName(conn_engine) -> str:
+    """ Name of the SQL dialect of conn_engine, 'mysql' when it has none."""
+    return getattr(getattr(conn_engine, 'dialect', None), 'name', 'mysql')
+
+
+def sqlLiteral(value, dialect='mysql') -> str:
+    """
+    Renders a python value as a SQL literal.
+
+    Parameters
+    ------
+    dialect (type: string) : SQL dialect, backslashes only escape characters in MySQL strings
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return "NULL"
+    if isinstance(value, (bool, np.bool_)):
+        return "1" if value else "0"
+    if isinstance(value, numbers.Number):
+        return str(value)
+    text = str(value)
+    if dialect in ('mysql', 'mariadb'):
+        text = text.replace("\\", "\\\\")
+    text = text.replace("'", "''")
+    return f"'{text}'"
+
+
+def portableQuery(query: str, conn_engine) -> str:
+    """
+    Query with MySQL '#' comments written as '--' comments for other databases, like a local stand-in.
+    A '#' in a string, quoted name or other comment is kept.
+    """
+    if dialectName(conn_engine) in ('mysql', 'mariadb'):
+        return query
+    return _QUOTED.sub(lambda match: match.group(1) or '--', query)
+
+
+@contextlib.contextmanager
+def checkedOut(conn_engine):
+    """
+    Connection to run one query on: engines (like the one of the pool) check out a connection
+    and return it when the with-block ends, connections are used as they are.
+    """
+    import sqlalchemy
+    if not isinstance(conn_engine, sqlalchemy.engine.Engine):
+        yield conn_engine
+    elif conn_engine is getattr(config.pool, '_engine', None):
+        with config.pool.connection() as connection:
+            yield connection
+    else:
+        with conn_engine.connect() as connection:
+            yield connection
+
+
+def fetchFrame(query: str, conn_engine, span=None):
+    """
+    Result of query as dataframe, like pd.read_sql.
+    Adds the time spent executing the query, fetching the rows and building the dataframe to span.
+    """
+    import sqlalchemy
+    with contextlib.ExitStack() as stack:
+        if isinstance(conn_engine, sqlalchemy.engine.Engine):
+            conn_engine = stack.enter_context(conn_engine.connect())
+        start = time.perf_counter()
+        result = conn_engine.exec_driver_sql(query)
+        executed = time.perf_counter()
+        columns = list(result.keys())
+        rows = result.fetchall()
+        fetched = time.perf_counter()
+    dataframe = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    if span is not None:
+        span.set(query_seconds=executed - start, fetch_seconds=fetched - executed,
+                 frame_seconds=time.perf_counter() - fetched)
+    return dataframe
+
+
+def fetchArrowFrame(query: str, conn_engine, dtype_backend='numpy', span=None):
+    """
+    Result of query read with connectorx, None when connectorx isn't installed,
+    can't read from conn_engine or fails on the query.
+    """
+    if not arrowFetch.available() or arrowFetch.connectionUri(conn_engine) is None:
+        return None
+    start = time.perf_counter()
+    try:
+        table = arrowFetch.fetchArrow(query, conn_engine)
+    except Exception as e:
+        warnings.warn(f"Arrow fetch failed, reading with sqlalchemy instead: {e}")
+        return None
+    fetched = time.perf_counter()
+    dataframe = arrowFetch.toPandas(table, dtype_backend)
+    if span is not None:
+        span.set(fetch_engine='connectorx', fetch_seconds=fetched - start,
+                 frame_seconds=time.perf_counter() - fetched)
+    return dataframe
 
 
 class QueryTable(object):
-    def __init__(self, query, conn_engine=conn_engine):
+    """
+    Object based on the dataframe resulting from query.
+
+    - With lazy=True the query runs on first access of dataframe.
+    - Until then select, where and isin are added to the query itself,
+      so only the needed rows and columns are read from the database:
+
+        QueryTable(query, lazy=True).select(['clientObjectId']).isin('status', [1, 2]).dataframe
+
+    Builds of subclasses are traced, see instrumentation.
+    """
+    # seconds a cached result of this dataset stays valid, None uses the cache default
+    cache_ttl = None
+
+    # dataset classes this dataset is built from, used by datasetLoader
+    dependencies = ()
+    # {column: kind} of the result, see compactTypes.compactFrame
+    schema = {}
+    # load columns in schema as compact types, per dataset class or QueryTable.compact = True for all datasets
+    compact = False
+    # query of the source rows for incremental refreshes, see enableIncremental and derive
+    delta_query = None
+    # column of delta_query with the time a row was last changed, None when rows change
+    # without such a timestamp: the dataset is then never refreshed incrementally
+    watermark = 'updatedAt'
+    # columns of delta_query identifying a row
+    primary_key = ['objectId']
+    # build the dataset with derive from all rows of delta_query instead of running query,
+    # e.g. to pick the latest rows in pandas instead of in the database, see latestPerKey
+    derive_locally = False
+    # attributes with dataframes derived from the dataset, exported next to it, see datasetExport
+    derived_frames = ()
+    # False for datasets built in pandas from other datasets instead of from the rows of query,
+    # select, where, iter_chunks and arrowTable raise NotImplementedError for them
+    streamable = True
+    # query of all rows, also those not active anymore, see asOf
+    history_query = None
+    # (start, end) columns of the period a row of history_query is active in
+    period = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        instrumentation.traceInit(cls)
+
+    def __init__(self, query, conn_engine=None, lazy=False, compact=None):
         self.query = query
-        self.dataframe = pd.read_sql(self.query, conn_engine)
+        self.conn_engine = conn_engine
+        if compact is not None:
+            self.compact = compact
+        self._columns = None
+        self._conditions = []
+        self._dataframe = None
+        if not lazy:
+            self.load()
+
+    @property
+    def dataframe(self):
+        if self._dataframe is None:
+            self.load()
+        return self._dataframe
+
+    @dataframe.setter
+    def dataframe(self, dataframe):
+        self._dataframe = dataframe
+
+    @property
+    def loaded(self) -> bool:
+        return self._dataframe is not None
+
+    def load(self):
+        """ Runs the query including selected columns and conditions."""
+        with instrumentation.span(type(self).__name__, 'load', owner=self) as span:
+            start = time.perf_counter()
+            rows = self.localRows() if self._plain else None
+            if rows is not None:
+                dataframe = self.derive(rows)
+            elif self.incremental:
+                dataframe = self.derive(snapshots.rows(self))
+            elif self.derive_locally and self.delta_query is not None and self._plain:
+                dataframe = self.derive(self.readQuery(self.delta_query))
+            else:
+                dataframe = self.readQuery(self.compiledQuery)
+            read = time.perf_counter()
+            self._dataframe = self.compactTypes(self.transform(dataframe))
+            span.set(read_seconds=read - start, transform_seconds=time.perf_counter() - read)
+            span.describe(self._dataframe)
+        return self._dataframe
+
+    @property
+    def incremental(self) -> bool:
+        """ Whether load refreshes the stored rows of delta_query instead of running the query."""
+        return snapshots is not None and self.delta_query is not None \
+            and self.watermark is not None and self._plain
+
+    @property
+    def _plain(self) -> bool:
+        # no columns selected or conditions added to the query
+        return self._columns is None and not self._conditions
+
+    def derive(self, rows):
+        """ Builds the result of query from all rows of delta_query."""
+        return rows
+
+    def localRows(self):
+        """
+        Rows to derive the dataset from without running query, e.g. from documentIndex,
+        None to read from the database.
+        """
+        return None
+
+    def history(self):
+        """ All rows of history_query, cleaned like the dataset."""
+        if self.history_query is None or self.period is None:
+            raise ValueError(f"{type(self).__name__} has no history_query and period to look back in time")
+        return self.compactTypes(self.transform(self.readQuery(self.history_query)))
+
+    def asOf(self, dates):
+        """
+        The dataset as it was at each of dates, with the date in column asOfDate.
+        history_query is read once for all dates, e.g. ClientsInCare(lazy=True).asOf(intervals.monthStarts('2019', '2024'))
+        """
+        start, end = self.period
+        return self.deriveAsOf(intervals.asOf(self.history(), start, end, dates))
+
+    def deriveAsOf(self, rows):
+        """ Builds the dataset at every asOfDate from the rows active at that date, like derive."""
+        return rows
+
+    def compactTypes(self, dataframe, chunked=False):
+        """ Converts dataframe (a chunk with chunked=True) to the compact types in schema when compact is set."""
+        if not self.compact:
+            return dataframe
+        return compactFrame(dataframe, self.schema, chunked=chunked)
+
+    def transform(self, dataframe):
+        """
+        Cleaning that only depends on the rows themselves, applied on load and to each chunk of iter_chunks.
+        Datasets override this instead of cleaning in __init__ so they can be streamed.
+        """
+        return dataframe
+
+    def iter_chunks(self, chunksize=100000):
+        """
+        Yields the result of the query in dataframes of at most chunksize rows.
+        The result is read with a server side cursor, so memory use is bounded by chunksize.
+        """
+        self._checkStreamable('iter_chunks')
+        import sqlalchemy
+        # a connection of its own while the cursor is open, other queries (like the client columns
+        # of a chunk) would otherwise fail on it or read the rest of the stream first
+        with checkedOut(self.connection) as connection:
+            query = sqlalchemy.text(portableQuery(self.compiledQuery, connection)).execution_options(
+                stream_results=True)
+            for chunk in pd.read_sql(query, connection, chunksize=chunksize):
+                yield self.compactTypes(self.transform(chunk), chunked=True)
+
+    def writeChunks(self, path, chunksize=100000):
+        """
+        Writes the result of the query to a parquet or (when path ends with .csv) csv file chunk by chunk.
+        Returns the number of rows written.
+        """
+        path = str(path)
+        rows = 0
+        writer = None
+        try:
+            for chunk in self.iter_chunks(chunksize=chunksize):
+                if path.endswith('.csv'):
+                    chunk.to_csv(path, mode='w' if rows == 0 else 'a',
+                                 header=rows == 0, index=False)
+                else:
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+                    if writer is None:
+                        table = pa.Table.from_pandas(chunk, preserve_index=False)
+                        # categoricals of later chunks may have more categories than fit the first chunk's codes
+                        table = table.cast(pa.schema([
+                            field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+                            if pa.types.is_dictionary(field.type) else field
+                            for field in table.schema
+                        ], metadata=table.schema.metadata))
+                        writer = pq.ParquetWriter(path, table.schema)
+                    else:
+                        table = pa.Table.from_pandas(
+                            chunk, schema=writer.schema, preserve_index=False)
+                    writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    @property
+    def compiledQuery(self) -> str:
+        """ The query wrapped in a subquery with the selected columns and conditions."""
+        if self._columns is None and not self._conditions:
+            return self.query
+        columns = '*' if self._columns is None else ', '.join(self._columns)
+        # newline ends a trailing comment in the wrapped query
+        query = f"select {columns} from (\n{self.query}\n) as q"
+        if self._conditions:
+            query += "\nwhere " + "\nand ".join(
+                f"({condition})" for condition in self._conditions)
+        return query
+
+    def select(self, columns):
+        """ Only reads columns (names of the query's result) from the database."""
+        self._checkNotLoaded()
+        self._columns = list(columns)
+        return self
+
+    def where(self, condition: str):
+        """ Only reads rows satisfying condition, a SQL expression on the query's result."""
+        self._checkNotLoaded()
+        self._conditions.append(condition)
+        return self
+
+    def isin(self, column: str, values, negate=False):
+        """
+        Only reads rows where column is one of values.
+        With negate=True rows where column is not one of values, including nulls like pandas ~isin.
+        """
+        literals = ', '.join(sqlLiteral(value, self.dialect) for value in values)
+        if negate:
+            if not literals:
+                return self
+            return self.where(f"{column} is null or {column} not in ({literals})")
+        return self.where(f"{column} in ({literals})" if literals else "1 = 0")
+
+    def _checkStreamable(self, method):
+        if not self.streamable:
+            raise NotImplementedError(
+                f"{type(self).__name__} is built from other datasets in pandas, {method} isn't supported")
+
+    def _checkNotLoaded(self):
+        self._checkStreamable('selecting columns or conditions')
+        if self.loaded:
+            raise ValueError(
+                f"{type(self).__name__} is already loaded, create it with lazy=True to select or filter in the query")
+
+    @property
+    def connection(self):
+        """
+        conn_engine given to the constructor, or the engine of the pool. Every query on an engine
+        checks out a connection and returns it (see checkedOut), so connections are tested (pre_ping)
+        and recycled by the pool and no transaction stays open between queries.
+        """
+        if self.conn_engine is None:
+            return config.pool.engine
+        return self.conn_engine
+
+    @property
+    def dialect(self) -> str:
+        """ SQL dialect of the queries, read from the engine or connection without connecting."""
+        if self.conn_engine is None:
+            return config.pool.engine.dialect.name
+        return dialectName(self.conn_engine)
+
+    def readQuery(self, query, conn_engine=None):
+        """ Runs query, reusing results of the running session and the result cache."""
+        if conn_engine is None:
+            conn_engine = self.connection
+        if registry is None:
+            return self._loadQuery(query, conn_engine)
+        return registry.get(
+            query, conn_engine, lambda: self._loadQuery(query, conn_engine))
+
+    def executeQuery(self, query, conn_engine=None):
+        """ Runs query on the database, bypassing the session and the result cache."""
+        if conn_engine is None:
+            conn_engine = self.connection
+        start = time.perf_counter()
+        with instrumentation.span(type(self).__name__, 'query') as span:
+            if instrumentation.enabled():
+                span.set(query=normalizeQuery(query))
+            portable = portableQuery(query, conn_engine)
+            dataframe = None
+            if arrow is not None:
+                dataframe = fetchArrowFrame(portable, conn_engine, arrow, span)
+            if dataframe is None:
+                with checkedOut(conn_engine) as connection:
+                    # the split into query, fetch and dataframe time is only measured while tracing
+                    if instrumentation.enabled():
+                        dataframe = fetchFrame(portable, connection, span)
+                    else:
+                        dataframe = pd.read_sql(portable, connection)
+                if arrow == 'pyarrow':
+                    dataframe = dataframe.convert_dtypes(dtype_backend='pyarrow')
+            span.describe(dataframe)
+        if analyzer is not None:
+            analyzer.record(type(self).__name__, query, conn_engine, time.perf_counter() - start, len(dataframe))
+        return dataframe
+
+    def arrowTable(self):
+        """
+        Rows of the query including selected columns and conditions as pyarrow Table.
+        Read with connectorx when possible, otherwise converted from the regular result.
+        Datasets with a transform are transformed in pandas and converted back.
+        """
+        self._checkStreamable('arrowTable')
+        import pyarrow as pa
+        conn_engine = self.connection
+        query = portableQuery(self.compiledQuery, conn_engine)
+        if type(self).transform is QueryTable.transform \
+                and arrowFetch.available() and arrowFetch.connectionUri(conn_engine) is not None:
+            return arrowFetch.fetchArrow(query, conn_engine)
+        with checkedOut(conn_engine) as connection:
+            dataframe = pd.read_sql(query, connection)
+        dataframe = self.compactTypes(self.transform(dataframe))
+        return pa.Table.from_pandas(dataframe, preserve_index=False)
+
+    def _loadQuery(self, query, conn_engine):
+        if cache is None:
+            return self.executeQuery(query, conn_engine)
+        key = cache.key(query, conn_engine)
+        with instrumentation.span(type(self).__name__, 'cache') as span:
+            dataframe = cache.get(key, ttl=self.cache_ttl)
+            span.set(hit=dataframe is not None)
+        if dataframe is None:
+            dataframe = self.executeQuery(query, conn_engine)
+            cache.put(key, dataframe, dataset=type(self).__name__)
+        return dataframe
+
+    @classmethod
+    def invalidateCache(cls, dependencies=True):
+        """
+        Removes all cached results loaded by this dataset class and, with dependencies=True,
+        by the datasets it is built from (see dependencies), so a reload reads them all again.
+        """
+        if cache is None:
+            return 0
+        if not dependencies:
+            return cache.invalidate(dataset=cls)
+        from datasetLoader import dependencyGraph
+        return sum(cache.invalidate(dataset=dataset) for dataset in dependencyGraph([cls]))
 
     def replaceExactValueInColumn(self, from_value, to_value, column):
-        mask = self.dataframe[column] == from_value
-        self.dataframe.loc[mask, column] = to_value
+        self.dataframe = replaceExactValue(
+            self.dataframe, from_value, to_value, column)
 
     def replaceValueContainedInColumn(self, from_value, to_value, column):
-        mask = self.dataframe[column].str.contains(from_value)
-        self.dataframe.loc[mask, column] = to_value
+        self.dataframe = replaceValueContained(
+            self.dataframe, from_value, to_value, column)
+
+
+def replaceExactValue(dataframe, from_value, to_value, column):
+    """ Replaces from_value in column of dataframe (or a chunk of it) by to_value."""
+    mask = dataframe[column] == from_value
+    dataframe = _allowValue(dataframe, column, to_value)
+    dataframe.loc[mask, column] = to_value
+    return dataframe
+
+
+def replaceValueContained(dataframe, from_value, to_value, column):
+    """ Replaces values in column of dataframe (or a chunk of it) containing from_value by to_value."""
+    mask = dataframe[column].str.contains(from_value, na=False)
+    dataframe = _allowValue(dataframe, column, to_value)
+    dataframe.loc[mask, column] = to_value
+    return dataframe
+
+
+def _allowValue(dataframe, column, value):
+    # categorical columns only accept values that are one of their categories
+    series = dataframe[column]
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        dataframe[column] = series.cat.add_categories([value])
+    return dataframe
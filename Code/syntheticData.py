@@ -0,0 +1,288 @@
+"""
+Generates a local stand-in for the ONS database with synthetic data.
+
+The stand-in is a sqlite database with the tables and columns the dataset
+classes query, so datasets can be built and benchmarked without access to ONS:
+
+    python syntheticData.py --clients 100000
+
+    import configuration as config, syntheticData
+    config.useEngine(syntheticData.standInEngine())
+"""
+import argparse
+import datetime
+import itertools
+import pathlib
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+DEFAULT_PATH = pathlib.Path(__file__).absolute().parents[1] / 'Sample_Data' / 'synthetic_ons.sqlite'
+
+# location ids the dataset classes refer to directly
+EXTRAMURAL_IDS = [270, 98, 271, 272, 273]
+PSYCHOGERIATRIC_IDS = [490, 507, 524, 533, 138, 48, 71, 111, 125,
+                       186, 236, 213, 237, 163, 239, 230, 238]
+
+# rows per client of every table with client data
+TABLE_SCALES = {
+    'clients': 1,
+    'care_allocations': 1.2,
+    'location_assignments': 1.5,
+    'care_orders': 2,
+    'documents': 10,
+    'document_tags': 6,
+    'notifications': 3,
+    'client_employee_relations': 2,
+    'relations': 0.5
+}
+
+FINANCE_TYPES = [
+    'AWBZ extramuraal', 'Wet maatschappelijke ondersteuning', 'Zorgverzekeringswet',
+    'Paramedische Eerstelijnszorg', 'Wet langdurige zorg', 'Indicatievrije WLZ',
+    'Interne doorbelasting', 'Niet declarabel', 'Onderaannemerschap'
+]
+FILENAMES = [
+    'zorgovereenkomst.pdf', 'zorgovereenkomst getekend.pdf', 'rekenmodule.xlsx',
+    'zorgplan.pdf', 'rapportage.docx', 'indicatiebesluit.pdf'
+]
+TAGS = [14, 32, 5, 7]
+NOTIFICATION_TYPES = [152, 150, 151, 153]
+RELATION_NAMES = ['EVV', 'Behandelaar', 'Contactpersoon', 'Regiebehandelaar']
+ROOM_TYPES = ['Eenpersoonskamer', 'Tweepersoonskamer', 'Appartement', 'Studio']
+RELATION_TYPES = [
+    (1, 'Wettelijke vertegenwoordiger', 1), (2, 'Mentor (wettelijke vertegenwoordiger)', 1),
+    (3, 'Contactpersoon', 2), (4, 'Partner', 2), (5, 'Kind', 2)
+]
+
+_START = np.datetime64('2012-01-01', 's')
+_END = np.datetime64('2027-12-31', 's')
+
+
+def standInEngine(path=DEFAULT_PATH):
+    """ Engine on a stand-in database, with the MySQL functions the dataset queries use."""
+    engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def addFunctions(dbapi_connection, connection_record):
+        dbapi_connection.create_function(
+            'CURDATE', 0, lambda: datetime.date.today().isoformat())
+
+    return engine
+
+
+def _timestamps(rng, count, unit='s'):
+    seconds = rng.integers(0, int((_END - _START) / np.timedelta64(1, 's')), count)
+    stamps = np.datetime_as_string(_START + seconds.astype('timedelta64[s]'), unit=unit)
+    return np.char.replace(stamps, 'T', ' ')
+
+
+def _periods(rng, count, open_share=0.4):
+    """ Begin and end dates, end dates missing (still active) for open_share of the rows."""
+    begin = _START + rng.integers(0, 5000, count).astype('timedelta64[D]')
+    end = begin + rng.integers(1, 2000, count).astype('timedelta64[D]')
+    end = pd.Series(np.datetime_as_string(end, unit='D'), dtype=object)
+    end[rng.random(count) < open_share] = None
+    return np.datetime_as_string(begin, unit='D'), end
+
+
+def _ids(rng, high, count):
+    return rng.integers(1, high + 1, count)
+
+
+def locationRows(rng, locations=12, afdelingen=8, rooms=12):
+    """ locations table: locations (type 3) with afdelingen (type 2) with rooms (type 1)."""
+    reserved = set(EXTRAMURAL_IDS) | set(PSYCHOGERIATRIC_IDS)
+    free = (i for i in itertools.count(1) if i not in reserved)
+    psychogeriatric = list(PSYCHOGERIATRIC_IDS)
+    rows = []
+    for location in range(locations):
+        locationId = next(free)
+        name = f"Huur {location}" if location % 6 == 5 else f"Locatie {location}"
+        rows.append((locationId, name, 3, None, None, 1))
+        for afdeling in range(afdelingen):
+            if psychogeriatric and afdeling % 2 == 0:
+                afdelingId = psychogeriatric.pop()
+            else:
+                afdelingId = next(free)
+            rows.append((afdelingId, f"Afdeling {location}.{afdeling}", 2, locationId, None, 1))
+            for room in range(rooms):
+                rows.append((next(free), f"Kamer {location}.{afdeling}.{room}", 1,
+                             afdelingId, int(rng.integers(1, len(ROOM_TYPES) + 1)), 1))
+    for afdelingId in psychogeriatric:
+        rows.append((afdelingId, f"Afdeling {afdelingId}", 2, rows[0][0], None, 1))
+    for locationId in EXTRAMURAL_IDS:
+        rows.append((locationId, f"Wijk {locationId}", 3, None, None, 0))
+    return pd.DataFrame(rows, columns=[
+        'objectId', 'name', 'type', 'parentObjectId', 'roomTypeObjectId', 'intramuralLocation'])
+
+
+def _clientTable(name, rng, start, count, clients, employees, assignable):
+    objectId = np.arange(start + 1, start + count + 1)
+    client = _ids(rng, clients, count)
+    if name == 'clients':
+        return pd.DataFrame({
+            'objectId': objectId,
+            'identificationNo': objectId + 100000,
+            'bsn': rng.integers(100000000, 999999999, count),
+            'name': [f"Client {i}" for i in objectId],
+            'gender': rng.choice(['M', 'V', 'O'], count),
+            'emailAddress': [f"client{i}@example.org" for i in objectId],
+            'mobilePhone': [f"06{i:08d}" for i in objectId]
+        })
+    if name == 'care_allocations':
+        begin, end = _periods(rng, count)
+        return pd.DataFrame({
+            'objectId': objectId, 'clientObjectId': client,
+            'createdAt': _timestamps(rng, count), 'dateBegin': begin, 'dateEnd': end
+        })
+    if name == 'location_assignments':
+        begin, end = _periods(rng, count)
+        return pd.DataFrame({
+            'objectId': objectId, 'clientObjectId': client,
+            'locationObjectId': rng.choice(assignable, count),
+            'beginDate': begin, 'endDate': end,
+            'locationType': rng.choice(['MAIN', 'TEMPORARY'], count, p=[0.8, 0.2])
+        })
+    if name == 'care_orders':
+        begin, end = _periods(rng, count)
+        return pd.DataFrame({
+            'objectId': objectId, 'clientObjectId': client,
+            'financeTypeObjectId': _ids(rng, len(FINANCE_TYPES), count),
+            'beginDate': begin, 'endDate': end
+        })
+    if name == 'documents':
+        filename = rng.choice(FILENAMES, count)
+        return pd.DataFrame({
+            'objectId': objectId, 'clientObjectId': client,
+            'employeeObjectId': _ids(rng, employees, count),
+            'filename': filename, 'description': np.char.add('Document ', filename),
+            'status': rng.integers(0, 4, count), 'updatedAt': _timestamps(rng, count)
+        })
+    if name == 'document_tags':
+        documents = int(clients * TABLE_SCALES['documents'])
+        return pd.DataFrame({
+            'objectId': objectId, 'documentObjectId': _ids(rng, documents, count),
+            'tagObjectId': rng.choice(TAGS, count)
+        })
+    if name == 'notifications':
+        return pd.DataFrame({
+            'objectId': objectId, 'clientObjectId': client,
+            'notificationTypeObjectId': rng.choice(NOTIFICATION_TYPES, count),
+            'createdAt': _timestamps(rng, count),
+            'title': rng.choice(['Client in zorg opgenomen', 'Client verhuisd', 'Zorg beeindigd'], count),
+            'subtitle': [f"Melding {i}" for i in objectId]
+        })
+    if name == 'client_employee_relations':
+        begin, end = _periods(rng, count)
+        return pd.DataFrame({
+            'objectId': objectId, 'clientObjectId': client,
+            'employeeObjectId': _ids(rng, employees, count),
+            'relationName': rng.choice(RELATION_NAMES, count),
+            'validFrom': begin, 'validTo': end, 'createdAt': _timestamps(rng, count)
+        })
+    if name == 'relations':
+        return pd.DataFrame({
+            'objectId': objectId, 'clientObjectId': client,
+            'clientContactRelationTypeId': _ids(rng, len(RELATION_TYPES), count),
+            'firstName': [f"Relatie {i}" for i in objectId],
+            'birthNamePrefix': rng.choice(['', 'van', 'de', 'van der'], count),
+            'birthName': [f"Achternaam {i}" for i in objectId],
+            'updatedAt': _timestamps(rng, count)
+        })
+    raise ValueError(f"Unknown table {name}")
+
+
+def generate(path=DEFAULT_PATH, clients=10000, seed=0, chunk_size=500000):
+    """
+    Writes a stand-in database with synthetic data to path.
+
+    Parameters
+    ------
+    path (type: string) : sqlite file, replaced when it exists
+    clients (type: int) : number of clients, other tables scale along (see TABLE_SCALES),
+        documents has 10 rows per client
+    seed (type: int) : seed of the random generator, the same seed gives the same data
+    chunk_size (type: int) : rows generated and written at once
+    Returns
+    ------
+    {table: number of rows}
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    rng = np.random.default_rng(seed)
+    engine = standInEngine(path)
+    employees = max(100, clients // 20)
+    counts = {}
+    with engine.begin() as conn:
+        locations = locationRows(rng)
+        afdelingen = locations.loc[locations['type'] == 2, 'objectId'].to_numpy()
+        assignable = np.concatenate([afdelingen, EXTRAMURAL_IDS])
+        fixed = {
+            'locations': locations,
+            'roomtypes': pd.DataFrame({
+                'objectId': range(1, len(ROOM_TYPES) + 1), 'description': ROOM_TYPES}),
+            'finance_types': pd.DataFrame({
+                'objectId': range(1, len(FINANCE_TYPES) + 1), 'description': FINANCE_TYPES}),
+            'employees': pd.DataFrame({
+                'objectId': range(1, employees + 1),
+                'emailAddress': [
+                    '' if i % 25 == 0 else f"medewerker{i}@example.org" for i in range(1, employees + 1)],
+                'dateOfBirth': ['1980-01-01' if i % 10 else None for i in range(1, employees + 1)]
+            }),
+            'nexus_client_contact_relation_types': pd.DataFrame(
+                RELATION_TYPES, columns=['objectId', 'name', 'categoryObjectId']),
+            'nexus_relation_type_categories': pd.DataFrame({
+                'objectId': [1, 2], 'name': ['Wettelijk', 'Overig']})
+        }
+        for table, dataframe in fixed.items():
+            dataframe.to_sql(table, conn, index=False)
+            counts[table] = len(dataframe)
+
+        for table, scale in TABLE_SCALES.items():
+            total = int(clients * scale)
+            for start in range(0, total, chunk_size):
+                chunk = _clientTable(table, rng, start, min(chunk_size, total - start),
+                                     clients, employees, assignable)
+                chunk.to_sql(table, conn, index=False, if_exists='append')
+            counts[table] = total
+
+        # every relation has an address
+        relations = counts['relations']
+        for start in range(0, relations, chunk_size):
+            ids = np.arange(start + 1, min(start + chunk_size, relations) + 1)
+            pd.DataFrame({'relationObjectId': ids, 'addressObjectId': ids}).to_sql(
+                'relations_addresses', conn, index=False, if_exists='append')
+            pd.DataFrame({
+                'objectId': ids,
+                'telephoneNumber': [f"070{i:07d}" for i in ids],
+                'telephoneNumber2': None,
+                'email': [f"relatie{i}@example.org" for i in ids]
+            }).to_sql('addresses', conn, index=False, if_exists='append')
+        counts['relations_addresses'] = counts['addresses'] = relations
+
+        for table in counts:
+            if table != 'relations_addresses':
+                conn.exec_driver_sql(f"create index ix_{table}_objectId on {table} (objectId)")
+        for table, column in [
+                ('locations', 'parentObjectId'), ('care_allocations', 'clientObjectId'),
+                ('location_assignments', 'clientObjectId'), ('care_orders', 'clientObjectId'),
+                ('documents', 'clientObjectId'), ('document_tags', 'documentObjectId'),
+                ('notifications', 'clientObjectId'), ('client_employee_relations', 'clientObjectId'),
+                ('relations', 'clientObjectId'), ('relations_addresses', 'relationObjectId')]:
+            conn.exec_driver_sql(f"create index ix_{table}_{column} on {table} ({column})")
+    engine.dispose()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default=str(DEFAULT_PATH))
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+    for table, rows in generate(arguments.path, clients=arguments.clients, seed=arguments.seed).items():
+        print(f"{table}: {rows} rows")
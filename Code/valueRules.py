@@ -0,0 +1,89 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+class ValueRules(object):
+    """
+    Drop and rename rules for the values of a text column, applied in one pass.
+
+    - Values equal to one of drop are removed.
+    - Values containing the first value of a rename pair become the second value,
+      pairs are applied in order like consecutive replaceValueContained calls.
+
+    Rules are evaluated once per distinct value; the rows only get new category codes.
+    """
+
+    def __init__(self, drop=(), rename=()):
+        self.drop = list(drop)
+        self.rename = list(rename)
+
+    def labels(self, values):
+        """ Normalized label of each of values, None for dropped values."""
+        labels = []
+        for value in values:
+            if value in self.drop:
+                labels.append(None)
+                continue
+            for (from_value, to_value) in self.rename:
+                if re.search(from_value, value):
+                    value = to_value
+            labels.append(value)
+        return labels
+
+    def apply(self, series) -> pd.Series:
+        """
+        Normalized series as categorical, rows with dropped values become missing.
+        Categories are sorted.
+        """
+        categorical = series.astype('category') if not isinstance(
+            series.dtype, pd.CategoricalDtype) else series
+        labels = pd.Series(self.labels(categorical.cat.categories.astype(str)), dtype=object)
+        categories = np.sort(labels.dropna().unique())
+        # new code of every old code, -1 for dropped values
+        recode = pd.Index(categories).get_indexer(labels)
+        codes = categorical.cat.codes.to_numpy()
+        codes = np.where(codes >= 0, recode[codes], -1)
+        return pd.Series(pd.Categorical.from_codes(codes, categories=categories),
+                         index=series.index, name=series.name)
+
+    def filter(self, dataframe, column) -> pd.DataFrame:
+        """ dataframe without the rows with dropped values and with normalized column."""
+        dropped = dataframe[column].isin(self.drop)
+        dataframe = dataframe[~dropped].copy()
+        dataframe[column] = self.apply(dataframe[column])
+        return dataframe
+
+
+def multiHot(dataframe, key, column, sparse=False) -> pd.DataFrame:
+    """
+    Indicator matrix with a row per key and a boolean column per value of column.
+    With sparse=True the columns are sparse, for values that few keys have.
+    """
+    keys, key_uniques = pd.factorize(dataframe[key], sort=True)
+    values = dataframe[column].astype('category')
+    codes = values.cat.codes.to_numpy()
+    present = (keys >= 0) & (codes >= 0)
+    matrix = np.zeros((len(key_uniques), len(values.cat.categories)), dtype=bool)
+    matrix[keys[present], codes[present]] = True
+    result = pd.DataFrame(matrix, index=pd.Index(key_uniques, name=key),
+                          columns=pd.Index(values.cat.categories.astype(str), name=column))
+    if sparse:
+        result = result.astype(pd.SparseDtype(bool, False))
+    return result
+
+
+def joinedValues(matrix, separator=', ') -> pd.Series:
+    """
+    Set values of every row of a multiHot matrix joined in column order.
+    Joins once per distinct combination of values instead of once per row.
+    """
+    bits = matrix.to_numpy(dtype=bool)
+    combinations, inverse = np.unique(np.packbits(bits, axis=1), axis=0, return_inverse=True)
+    names = np.asarray(matrix.columns, dtype=object)
+    joined = np.array([
+        separator.join(names[row]) for row in
+        np.unpackbits(combinations, axis=1, count=bits.shape[1]).astype(bool)
+    ], dtype=object)
+    return pd.Series(joined[inverse.reshape(-1)], index=matrix.index)